@@ -10,22 +10,59 @@ SRC_DIR = ROOT / "src"
 if str(SRC_DIR) not in sys.path:
     sys.path.insert(0, str(SRC_DIR))
 from pathlib import Path
+from typing import Iterable, Optional
 
 import numpy as np
 import pandas as pd
 
-from study04.data import PRIME_COLUMNS
+from study04.data import PRIME_COLUMNS, abs_prime_stats, group_modes, write_table
 
 warnings.filterwarnings("ignore", message="Mean of empty slice")
 
 LOG = logging.getLogger("prep_study04_layer_data")
 
-
-def load_required(path: Path) -> pd.DataFrame:
+# Columns each input contributes to the merge/aggregate; everything else is skipped at parse time.
+CARRIER_COLUMNS = (
+    "name",
+    "carrier_element",
+    "carrier_block",
+    "carrier_group",
+    "carrier_period",
+    "carrier_Z",
+    "include_study04",
+)
+FINGERPRINT_COLUMNS = ("material", "N", *PRIME_COLUMNS)
+NOISE_COLUMNS = ("name", "predicted_noise")
+PARTICIPATION_COLUMNS = ("name", "N_value", "delta_value")
+# Columns the per-carrier aggregation reads once the inclusion mask is applied.
+AGG_INPUT_COLUMNS = (
+    "carrier_element",
+    "carrier_block",
+    "carrier_group",
+    "carrier_period",
+    "carrier_Z",
+    "N",
+    "delta_N",
+    "predicted_noise",
+    *PRIME_COLUMNS,
+)
+# Low-cardinality group keys; categorical codes make the groupbys hash ints, not strings.
+CATEGORICAL_COLUMNS = ("carrier_element", "carrier_block")
+
+
+def load_required(path: Path, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
     if not path.exists():
         raise FileNotFoundError(f"Missing required file: {path}")
     LOG.info("Loaded %s (%d bytes)", path, path.stat().st_size)
-    return pd.read_csv(path)
+    if columns is None:
+        df = pd.read_csv(path)
+    else:
+        wanted = set(columns)
+        df = pd.read_csv(path, usecols=lambda c: c in wanted)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    return df
 
 
 def main():
@@ -41,10 +78,10 @@ def main():
     if not participation_path.exists():
         participation_path = root / "data/raw/participation_summary.csv"
 
-    carriers = load_required(carriers_path).rename(columns={"name": "material"})
-    fingerprints = load_required(fingerprints_path)
-    noise_df = load_required(noise_path).rename(columns={"name": "material"})
-    participation = load_required(participation_path)
+    carriers = load_required(carriers_path, CARRIER_COLUMNS).rename(columns={"name": "material"})
+    fingerprints = load_required(fingerprints_path, FINGERPRINT_COLUMNS)
+    noise_df = load_required(noise_path, NOISE_COLUMNS).rename(columns={"name": "material"})
+    participation = load_required(participation_path, PARTICIPATION_COLUMNS)
     participation = participation.rename(columns={"name": "material", "N_value": "N", "delta_value": "delta_N"})
 
     if "delta_N" not in participation.columns and "N" in participation.columns:
@@ -59,42 +96,62 @@ def main():
 
     valid_primes = merged[PRIME_COLUMNS].notna().any(axis=1) & ~((merged[PRIME_COLUMNS] == 0).all(axis=1))
     include_mask = (merged["include_study04"] == 1) & valid_primes
-    filtered = merged.loc[include_mask].copy()
+    # Boolean .loc already yields a new frame; project to the aggregation inputs instead of copying everything.
+    needed = [c for c in AGG_INPUT_COLUMNS if c in merged.columns]
+    filtered = merged.loc[include_mask, needed]
 
     LOG.info("Materials total=%d, include=1 & valid_primes=%d", len(merged), len(filtered))
 
-    prime_missing_counts = {p: 0 for p in PRIME_COLUMNS}
-    records = []
-    for carrier, grp in filtered.groupby("carrier_element"):
-        rec = {
-            "carrier_element": carrier,
-            "block": grp["carrier_block"].mode().iat[0] if not grp["carrier_block"].dropna().empty else None,
-            "carrier_group": grp.get("carrier_group", pd.Series([np.nan] * len(grp))).mode().iat[0] if "carrier_group" in grp else None,
-            "carrier_period": grp.get("carrier_period", pd.Series([np.nan] * len(grp))).mode().iat[0] if "carrier_period" in grp else None,
-            "carrier_Z": grp.get("carrier_Z", pd.Series([np.nan] * len(grp))).median() if "carrier_Z" in grp else None,
-            "n_materials": len(grp),
-            "N_median": grp["N"].median() if "N" in grp else np.nan,
-        }
-        for p in PRIME_COLUMNS:
-            vals = grp[p].abs().dropna()
-            if vals.empty:
-                prime_missing_counts[p] += 1
-                LOG.warning("No valid %s values for carrier %s (n_materials=%d)", p, carrier, len(grp))
-                rec[f"abs_{p}_mean"] = np.nan
-                rec[f"abs_{p}_median"] = np.nan
-                rec[f"abs_{p}_std"] = np.nan
-            else:
-                rec[f"abs_{p}_mean"] = vals.mean()
-                rec[f"abs_{p}_median"] = vals.median()
-                rec[f"abs_{p}_std"] = vals.std(ddof=1)
-        rec["delta_N_median"] = grp["delta_N"].median()
-        rec["xi_ext_median"] = grp["predicted_noise"].median()
-        records.append(rec)
-
-    carrier_stats = pd.DataFrame.from_records(records)
+    grouped = filtered.groupby("carrier_element", observed=True)
+
+    agg_spec = {}
+    if "carrier_Z" in filtered:
+        agg_spec["carrier_Z"] = ("carrier_Z", "median")
+    agg_spec["n_materials"] = (PRIME_COLUMNS[0], "size")
+    if "N" in filtered:
+        agg_spec["N_median"] = ("N", "median")
+    agg_spec["delta_N_median"] = ("delta_N", "median")
+    agg_spec["xi_ext_median"] = ("predicted_noise", "median")
+
+    carrier_stats = grouped.agg(**agg_spec).reset_index()
+    prime_stats = abs_prime_stats(filtered["carrier_element"], filtered[PRIME_COLUMNS].to_numpy(dtype=float), prefix="abs_")
+    carrier_stats = carrier_stats.join(prime_stats, on="carrier_element")
+    for out_col, col in (("block", "carrier_block"), ("carrier_group", "carrier_group"), ("carrier_period", "carrier_period")):
+        if col in filtered:
+            carrier_stats[out_col] = carrier_stats["carrier_element"].map(group_modes(filtered, "carrier_element", col))
+    for col in ("block", "carrier_group", "carrier_period", "carrier_Z"):
+        if col not in carrier_stats:
+            carrier_stats[col] = None
+    if "N_median" not in carrier_stats:
+        carrier_stats["N_median"] = np.nan
+    prime_cols = [f"abs_{p}_{stat}" for p in PRIME_COLUMNS for stat in ("mean", "median", "std")]
+    carrier_stats = carrier_stats[
+        [
+            "carrier_element",
+            "block",
+            "carrier_group",
+            "carrier_period",
+            "carrier_Z",
+            "n_materials",
+            "N_median",
+            *prime_cols,
+            "delta_N_median",
+            "xi_ext_median",
+        ]
+    ]
+
+    # One carriers x primes non-null count; abs() does not change missingness, so the raw columns suffice.
+    missing = grouped[PRIME_COLUMNS].count() == 0
+    prime_missing_counts = missing.sum().astype(int).to_dict()
+    if missing.to_numpy().any():
+        n_materials = grouped.size()
+        for j, i in zip(*np.nonzero(missing.to_numpy().T)):
+            carrier = missing.index[i]
+            LOG.warning("No valid %s values for carrier %s (n_materials=%d)", PRIME_COLUMNS[j], carrier, n_materials[carrier])
+
     out_path = root / "data/processed/carrier_aggregate_stats.csv"
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    carrier_stats.to_csv(out_path, index=False)
+    write_table(carrier_stats, out_path)
     LOG.info("Saved carrier aggregates to %s (n=%d carriers)", out_path, len(carrier_stats))
     LOG.info("Missing prime counts by carrier: %s", prime_missing_counts)
 
@@ -10,9 +10,8 @@ if str(SRC_DIR) not in sys.path:
     sys.path.insert(0, str(SRC_DIR))
 from pathlib import Path
 
-import pandas as pd
-
-from study04.topology_engine import aggregate_costs, load_topology_catalog
+from study04.data import read_table, write_table
+from study04.topology_engine import AGG_COLUMNS, aggregate_costs, load_topology_catalog
 from study04.topology_plots import plot_topology_map
 
 LOG = logging.getLogger("infer_topologies_e_only")
@@ -27,7 +26,7 @@ def main():
     if not agg_path.exists():
         raise FileNotFoundError(f"Run prep_study04_layer_data.py first. Missing {agg_path}")
 
-    carrier_df = pd.read_csv(agg_path)
+    carrier_df = read_table(agg_path, columns=AGG_COLUMNS)
     catalog = load_topology_catalog(topo_path)
     LOG.info("Loaded %d carriers, %d topologies", len(carrier_df), len(catalog))
 
@@ -35,8 +34,8 @@ def main():
 
     out_scores = root / "data/processed/carrier_topology_scores_e_only.csv"
     out_best = root / "data/processed/carrier_topology_assignments_e_only.csv"
-    scores_df.to_csv(out_scores, index=False)
-    best_df.to_csv(out_best, index=False)
+    write_table(scores_df, out_scores)
+    write_table(best_df, out_best)
     LOG.info("Saved %s and %s", out_scores, out_best)
 
     if "best_topology_e_only" not in best_df.columns and "best_topology" in best_df.columns:
@@ -25,18 +25,19 @@ from study04 import (  # noqa: E402
     aggregate_element_table,
     apply_inclusion_rules,
     compute_atomic_resonance_matrix,
-    compute_block_statistics,
+    compute_block_statistics_from_arrays,
     load_material_data,
     plot_block_boxplots,
     plot_classifier_roc,
     plot_materials_histogram,
     plot_periodic_resonance_map,
     plot_scatter_primes,
-    run_permutation_nulls,
-    run_rotation_nulls,
+    run_permutation_nulls_from_arrays,
+    run_rotation_nulls_from_arrays,
     run_fingerprint_qc,
 )
-from study04.analysis import serialize_block_statistics  # noqa: E402
+from study04.analysis import prepare_working_arrays, serialize_block_statistics  # noqa: E402
+from study04.data import write_table  # noqa: E402
 
 
 def parse_args() -> argparse.Namespace:
@@ -71,6 +72,12 @@ def parse_args() -> argparse.Namespace:
         default=5000,
         help="Number of permutations for block-label null model.",
     )
+    parser.add_argument(
+        "--classifier-null",
+        choices=["fit", "lda"],
+        default="fit",
+        help="Classifier accuracy in the permutation null: refit per shuffle, or closed-form LDA (fast, approximate).",
+    )
     parser.add_argument(
         "--n-rotations",
         type=int,
@@ -105,7 +112,7 @@ def main() -> None:
         logging.warning(warning)
 
     agg_path = args.output_dir / "periodic_resonance_table.csv"
-    agg_result.table.to_csv(agg_path, index=False)
+    write_table(agg_result.table, agg_path)
     logging.info("Saved element table to %s", agg_path)
 
     resonance_matrix = compute_atomic_resonance_matrix(
@@ -115,25 +122,31 @@ def main() -> None:
     resonance_matrix.to_csv(matrix_path)
     logging.info("Saved atomic resonance matrix to %s", matrix_path)
 
-    stats = compute_block_statistics(
-        agg_result.table,
+    # Build the robust working set once; stats and both null models share it.
+    X, labels_int = prepare_working_arrays(
+        agg_result.table, n_min=args.n_min, prime_metric=args.prime_metric
+    )
+
+    stats = compute_block_statistics_from_arrays(
+        X,
+        labels_int,
+        n_elements=len(agg_result.table),
         n_min=args.n_min,
         prime_metric=args.prime_metric,
         random_state=args.random_state,
     )
     stats_json = serialize_block_statistics(stats)
 
-    perm_nulls = run_permutation_nulls(
-        agg_result.table,
-        n_min=args.n_min,
-        prime_metric=args.prime_metric,
+    perm_nulls = run_permutation_nulls_from_arrays(
+        X,
+        labels_int,
         n_perm=args.n_perm,
         random_state=args.random_state,
+        classifier_null=args.classifier_null,
     )
-    rot_nulls = run_rotation_nulls(
-        agg_result.table,
-        n_min=args.n_min,
-        prime_metric=args.prime_metric,
+    rot_nulls = run_rotation_nulls_from_arrays(
+        X,
+        labels_int,
         n_rotations=args.n_rotations,
         random_state=args.random_state,
     )
@@ -11,9 +11,8 @@ if str(SRC_DIR) not in sys.path:
     sys.path.insert(0, str(SRC_DIR))
 from pathlib import Path
 
-import pandas as pd
-
-from study04.resonant_engine import HyperParams, infer_topologies, load_topology_catalog
+from study04.data import read_table, write_table
+from study04.resonant_engine import AGG_COLUMNS, HyperParams, infer_topologies, load_topology_catalog
 from study04.topology_plots import plot_match_matrix, plot_topology_map
 
 LOG = logging.getLogger("resonant_layer_engine")
@@ -71,7 +70,7 @@ def main():
     if not agg_path.exists():
         raise FileNotFoundError(f"Missing aggregated carrier data: {agg_path}. Run prep_study04_layer_data.py first.")
 
-    carrier_df = pd.read_csv(agg_path)
+    carrier_df = read_table(agg_path, columns=AGG_COLUMNS)
     elements = _parse_list(args.elements)
     families = _parse_list(args.families)
     if elements:
@@ -99,8 +98,8 @@ def main():
 
     out_scores_path = root / "data/processed/element_topology_scores.csv"
     out_best_path = root / "data/processed/element_topology_inference.csv"
-    result.scores.to_csv(out_scores_path, index=False)
-    result.summary.to_csv(out_best_path, index=False)
+    write_table(result.scores, out_scores_path)
+    write_table(result.summary, out_best_path)
     LOG.info("Saved %s and %s", out_scores_path, out_best_path)
 
     figs_dir = root / "data/processed/figures/study04"
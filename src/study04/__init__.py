@@ -16,10 +16,16 @@ from .data import (
 )
 from .analysis import (
     compute_block_statistics,
+    compute_block_statistics_from_arrays,
     compute_atomic_resonance_matrix,
     evaluate_classifier,
 )
-from .null_models import run_permutation_nulls, run_rotation_nulls
+from .null_models import (
+    run_permutation_nulls,
+    run_permutation_nulls_from_arrays,
+    run_rotation_nulls,
+    run_rotation_nulls_from_arrays,
+)
 from .plots import (
     plot_periodic_resonance_map,
     plot_block_boxplots,
@@ -37,10 +43,13 @@ __all__ = [
     "filter_included_rows",
     "aggregate_element_table",
     "compute_block_statistics",
+    "compute_block_statistics_from_arrays",
     "compute_atomic_resonance_matrix",
     "evaluate_classifier",
     "run_permutation_nulls",
+    "run_permutation_nulls_from_arrays",
     "run_rotation_nulls",
+    "run_rotation_nulls_from_arrays",
     "plot_periodic_resonance_map",
     "plot_block_boxplots",
     "plot_scatter_primes",
@@ -5,7 +5,8 @@ from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
-from scipy.stats import mannwhitneyu
+from scipy.special import ndtr
+from scipy.stats import mannwhitneyu, rankdata
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import (
     accuracy_score,
@@ -13,22 +14,93 @@ from sklearn.metrics import (
     roc_auc_score,
     roc_curve,
 )
-from sklearn.model_selection import LeaveOneOut, StratifiedKFold, cross_val_predict
+from sklearn.model_selection import LeaveOneOut, StratifiedKFold
 
 PRIMES = ["e2", "e3", "e5", "e7"]
 
+# Integer block codes; masks become byte compares instead of string hashing.
+BLOCK_CODES: Dict[str, int] = {"s": 0, "p": 1, "d": 2, "f": 3}
+# Code for group labels outside BLOCK_CODES; encode_blocks only emits 0..3 and -1.
+UNKNOWN_GROUP_CODE = -2
+
+
+def _delta_from_u(u1: float, n1: int, n2: int) -> float:
+    """Cliff's delta from the Mann-Whitney U of the first sample (ties count 1/2)."""
+    # 2*U1 - n1*n2 == #(x > y) - #(x < y) exactly, so only the final division rounds.
+    return float((2.0 * u1 - n1 * n2) / (n1 * n2))
+
 
 def cliffs_delta(x: np.ndarray, y: np.ndarray) -> float:
-    """Compute Cliff's delta (effect size)."""
+    """
+    Compute Cliff's delta (effect size); NaN if either sample is empty or contains NaN.
+
+    >>> cliffs_delta(np.array([2.0, 3.0]), np.array([1.0, 2.0]))
+    0.75
+    >>> cliffs_delta(np.array([2.0, np.nan]), np.array([1.0]))
+    nan
+    """
     x = np.asarray(x)
     y = np.asarray(y)
     n1, n2 = len(x), len(y)
     if n1 == 0 or n2 == 0:
         return np.nan
-    # Efficient computation using broadcasting on signs.
-    comparisons = np.sign(x[:, None] - y[None, :])
-    delta = comparisons.sum() / (n1 * n2)
-    return float(delta)
+    # Sort-merge count against sorted y: #(y < x_i) and #(y > x_i) per x_i via binary search,
+    # O((n1+n2) log n2) time and O(n1+n2) memory instead of an n1 x n2 sign matrix.
+    ys = np.sort(y)
+    # searchsorted would rank NaN as largest; propagate it like the sign-matrix sum did.
+    if np.isnan(ys[-1]) or np.isnan(x).any():
+        return np.nan
+    gt = int(np.searchsorted(ys, x, side="left").sum())
+    lt = int((n2 - np.searchsorted(ys, x, side="right")).sum())
+    return float((gt - lt) / (n1 * n2))
+
+
+def _mann_whitney_two_sided(a_vals: np.ndarray, b_vals: np.ndarray) -> Tuple[float, float]:
+    """
+    Two-sided Mann-Whitney test returning (U1, p-value).
+
+    Uses the tie-corrected normal approximation with continuity correction,
+    which is what scipy's method="auto" selects unless both samples are tiny
+    and tie-free; that exact case is delegated to scipy.
+    """
+    n1, n2 = len(a_vals), len(b_vals)
+    pooled = np.concatenate([a_vals, b_vals])
+    ranks = rankdata(pooled)
+    u1 = float(ranks[:n1].sum() - n1 * (n1 + 1) / 2.0)
+    _, tie_counts = np.unique(pooled, return_counts=True)
+    if (n1 <= 8 or n2 <= 8) and not (tie_counts > 1).any():
+        return u1, float(mannwhitneyu(a_vals, b_vals, alternative="two-sided", method="exact").pvalue)
+
+    n = n1 + n2
+    u = max(u1, n1 * n2 - u1)
+    tie_term = float(np.sum(tie_counts.astype(float) ** 3 - tie_counts))
+    sigma = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1))))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (u - n1 * n2 / 2.0 - 0.5) / sigma
+    return u1, float(np.clip(2.0 * ndtr(-z), 0.0, 1.0))
+
+
+def encode_blocks(labels: Sequence[str]) -> np.ndarray:
+    """Map block labels to int8 codes (see BLOCK_CODES); unknown labels become -1."""
+    # Fixed categories keep the codes aligned with BLOCK_CODES rather than sorted label order.
+    return pd.Categorical(labels, categories=list(BLOCK_CODES)).codes.astype(np.int8, copy=False)
+
+
+def as_block_codes(labels: np.ndarray) -> np.ndarray:
+    """Pass BLOCK_CODES arrays through unchanged; encode string labels."""
+    labels = np.asarray(labels)
+    if np.issubdtype(labels.dtype, np.integer):
+        return labels
+    return encode_blocks(labels)
+
+
+def block_mask(codes: np.ndarray, group: Sequence[str]) -> np.ndarray:
+    """Boolean mask of codes (any shape) belonging to the given blocks."""
+    mask = np.zeros(codes.shape, dtype=bool)
+    for block in group:
+        # Unknown group labels select nothing (codes never hold this sentinel), like np.isin on labels.
+        mask |= codes == BLOCK_CODES.get(block, UNKNOWN_GROUP_CODE)
+    return mask
 
 
 def _select_prime_columns(metric: str) -> List[str]:
@@ -37,21 +109,31 @@ def _select_prime_columns(metric: str) -> List[str]:
     return [f"{p}_{metric}" for p in PRIMES]
 
 
+def _working_frame(agg_df: pd.DataFrame, n_min: int, prime_metric: str) -> Tuple[pd.DataFrame, List[str]]:
+    """Rows with n_materials >= n_min and complete features and block, plus the feature columns."""
+    working = agg_df.loc[agg_df["n_materials"] >= n_min].copy()
+    feature_cols = _select_prime_columns(prime_metric)
+    return working.dropna(subset=feature_cols + ["block"]), feature_cols
+
+
 def prepare_working_set(
     agg_df: pd.DataFrame, n_min: int, prime_metric: str
 ) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
     """Filter by n_min and build feature matrix + labels."""
-    working = agg_df.loc[agg_df["n_materials"] >= n_min].copy()
-    feature_cols = _select_prime_columns(prime_metric)
-    working = working.dropna(subset=feature_cols + ["block"])
+    working, feature_cols = _working_frame(agg_df, n_min, prime_metric)
     X = working[feature_cols].to_numpy(dtype=float)
     labels = working["block"].astype(str).to_numpy()
     return working, X, labels
 
 
-def _group_arrays(values: np.ndarray, labels: np.ndarray, target_labels: Sequence[str]):
-    mask = np.isin(labels, target_labels)
-    return values[mask]
+def prepare_working_arrays(
+    agg_df: pd.DataFrame, n_min: int, prime_metric: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Same working set as prepare_working_set, as a column-major X and int8 block codes."""
+    working, feature_cols = _working_frame(agg_df, n_min, prime_metric)
+    # Column-major: the tests and null models reduce one prime column at a time.
+    X = np.asfortranarray(working[feature_cols].to_numpy(dtype=float))
+    return X, encode_blocks(working["block"].astype(str))
 
 
 @dataclass
@@ -65,15 +147,43 @@ class TestResult:
 def mann_whitney_with_effect(
     values: np.ndarray, labels: np.ndarray, group_a: Sequence[str], group_b: Sequence[str]
 ) -> TestResult:
-    a_vals = _group_arrays(values, labels, group_a)
-    b_vals = _group_arrays(values, labels, group_b)
-    group_sizes = {"a": int(len(a_vals)), "b": int(len(b_vals))}
-    if len(a_vals) == 0 or len(b_vals) == 0:
-        return TestResult(group_sizes=group_sizes, delta=None, p_value=None, median_diff=None)
-    stat = mannwhitneyu(a_vals, b_vals, alternative="two-sided")
-    delta = cliffs_delta(a_vals, b_vals)
-    median_diff = float(np.median(a_vals) - np.median(b_vals))
-    return TestResult(group_sizes=group_sizes, delta=delta, p_value=float(stat.pvalue), median_diff=median_diff)
+    return mann_whitney_batch(np.asarray(values)[:, None], labels, group_a, group_b)[0]
+
+
+def mann_whitney_batch(
+    X_cols: np.ndarray, labels: np.ndarray, group_a: Sequence[str], group_b: Sequence[str]
+) -> List[TestResult]:
+    """
+    Run mann_whitney_with_effect on every column of X_cols, building the group masks once.
+
+    labels may be block strings or their BLOCK_CODES encoding.
+    """
+    codes = as_block_codes(labels)
+    mask_a = block_mask(codes, group_a)
+    mask_b = block_mask(codes, group_b)
+    n_a, n_b = int(mask_a.sum()), int(mask_b.sum())
+    group_sizes = {"a": n_a, "b": n_b}
+    if n_a == 0 or n_b == 0:
+        return [
+            TestResult(group_sizes=dict(group_sizes), delta=None, p_value=None, median_diff=None)
+            for _ in range(X_cols.shape[1])
+        ]
+
+    a_block = X_cols[mask_a]
+    b_block = X_cols[mask_b]
+    median_diffs = np.median(a_block, axis=0) - np.median(b_block, axis=0)
+    results: List[TestResult] = []
+    for j in range(X_cols.shape[1]):
+        u1, p_value = _mann_whitney_two_sided(a_block[:, j], b_block[:, j])
+        results.append(
+            TestResult(
+                group_sizes=dict(group_sizes),
+                delta=_delta_from_u(u1, n_a, n_b),
+                p_value=p_value,
+                median_diff=float(median_diffs[j]),
+            )
+        )
+    return results
 
 
 @dataclass
@@ -91,8 +201,8 @@ class ClassifierResult:
 def evaluate_classifier(
     X: np.ndarray, labels: np.ndarray, random_state: int = 0
 ) -> ClassifierResult:
-    """Binary classification for low (s+p) vs high (d+f) complexity."""
-    y = np.isin(labels, ["d", "f"]).astype(int)
+    """Binary classification for low (s+p) vs high (d+f) complexity; labels may be codes."""
+    y = (as_block_codes(labels) >= BLOCK_CODES["d"]).astype(int)
     n_positive = int(y.sum())
     n_negative = int(len(y) - n_positive)
     baseline_acc = max(n_positive, n_negative) / len(y) if len(y) > 0 else None
@@ -114,7 +224,12 @@ def evaluate_classifier(
     )
     model = LogisticRegression(max_iter=1000, solver="liblinear", class_weight="balanced")
 
-    probas = cross_val_predict(model, X, y, cv=cv, method="predict_proba")[:, 1]
+    # Fit folds directly: at this size cross_val_predict's dispatch costs more than the
+    # liblinear fits, and this function runs once per null-model iteration.
+    probas = np.empty(len(y), dtype=float)
+    for train_idx, test_idx in cv.split(X, y):
+        model.fit(X[train_idx], y[train_idx])
+        probas[test_idx] = model.predict_proba(X[test_idx])[:, 1]
     preds = (probas >= 0.5).astype(int)
 
     try:
@@ -152,19 +267,35 @@ class BlockStatistics:
 def compute_block_statistics(
     agg_df: pd.DataFrame, n_min: int, prime_metric: str, random_state: int = 0
 ) -> BlockStatistics:
-    working, X, labels = prepare_working_set(agg_df, n_min=n_min, prime_metric=prime_metric)
-    e2 = X[:, 0]
-    e5 = X[:, 2]
-    e7 = X[:, 3]
-
-    test1 = mann_whitney_with_effect(e2, labels, group_a=["p"], group_b=["d", "f"])
-    test2_e5 = mann_whitney_with_effect(e5, labels, group_a=["d", "f"], group_b=["s", "p"])
-    test2_e7 = mann_whitney_with_effect(e7, labels, group_a=["d", "f"], group_b=["s", "p"])
+    X, labels_int = prepare_working_arrays(agg_df, n_min=n_min, prime_metric=prime_metric)
+    return compute_block_statistics_from_arrays(
+        X,
+        labels_int,
+        n_elements=int(len(agg_df)),
+        n_min=n_min,
+        prime_metric=prime_metric,
+        random_state=random_state,
+    )
+
+
+def compute_block_statistics_from_arrays(
+    X: np.ndarray,
+    labels: np.ndarray,
+    n_elements: int,
+    n_min: int,
+    prime_metric: str,
+    random_state: int = 0,
+) -> BlockStatistics:
+    """Same as compute_block_statistics, on an already prepared working set (labels or codes)."""
+    labels = as_block_codes(labels)
+    # Columns of X: e2, e3, e5, e7.
+    (test1,) = mann_whitney_batch(X[:, [0]], labels, group_a=["p"], group_b=["d", "f"])
+    test2_e5, test2_e7 = mann_whitney_batch(X[:, [2, 3]], labels, group_a=["d", "f"], group_b=["s", "p"])
     clf_result = evaluate_classifier(X, labels, random_state=random_state)
 
     return BlockStatistics(
-        n_elements=int(len(agg_df)),
-        n_elements_robust=int(len(working)),
+        n_elements=int(n_elements),
+        n_elements_robust=int(len(labels)),
         n_min=n_min,
         prime_metric=prime_metric,
         test_p_vs_df_e2=test1,
@@ -179,13 +310,31 @@ def compute_atomic_resonance_matrix(
 ) -> pd.DataFrame:
     """Correlation between block indicators and prime magnitudes."""
     feature_cols = _select_prime_columns(prime_metric)
-    block_dummies = pd.get_dummies(agg_df["block"], prefix="block")
-    feature_df = agg_df[feature_cols]
-    matrix = pd.DataFrame(index=block_dummies.columns, columns=feature_cols, dtype=float)
-    for block_col in block_dummies:
-        for feat in feature_cols:
-            matrix.loc[block_col, feat] = block_dummies[block_col].corr(feature_df[feat])
-    return matrix
+    # One-hot straight from category codes; missing blocks (code -1) match no column, as in get_dummies.
+    blocks = agg_df["block"].astype("category")
+    categories = blocks.cat.categories
+    A = (blocks.cat.codes.to_numpy()[:, None] == np.arange(len(categories))[None, :]).astype(float)
+    F = agg_df[feature_cols].to_numpy(dtype=float)
+
+    # Pearson r over pairwise-complete rows (same as Series.corr). Each feature column has its own
+    # complete rows, so the block means are per (block, feature); centre once, then take dot products.
+    valid = ~np.isnan(F)
+    W = valid.astype(float)
+    n = W.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_a = (A.T @ W) / n
+        mean_f = np.where(valid, F, 0.0).sum(axis=0) / n
+        Fc = np.where(valid, F - mean_f, 0.0)
+        Ac = (A[:, :, None] - mean_a[None, :, :]) * W[:, None, :]
+        cov = np.einsum("ikp,ip->kp", Ac, Fc)
+        var_a = np.einsum("ikp,ikp->kp", Ac, Ac)
+        var_f = np.einsum("ip,ip->p", Fc, Fc)
+        corr = cov / np.sqrt(var_a * var_f)
+    # Constant features have zero variance; don't let rounding residue turn into an r value.
+    constant = np.where(valid, F, -np.inf).max(axis=0) == np.where(valid, F, np.inf).min(axis=0)
+    undefined = ~np.isfinite(corr) | (n < 2) | constant
+    corr[np.broadcast_to(undefined, corr.shape)] = np.nan
+    return pd.DataFrame(corr, index=[f"block_{c}" for c in categories], columns=feature_cols)
 
 
 def serialize_block_statistics(stats: BlockStatistics) -> Dict[str, object]:
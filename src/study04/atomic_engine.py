@@ -1,16 +1,16 @@
 from __future__ import annotations
 
 import json
-import math
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Optional, Sequence, Set, Tuple
 
 import numpy as np
 import pandas as pd
 
-from .topology_engine import PRIME_COLUMNS, Topology, load_topology_catalog
+from .topology_engine import PRIME_COLUMNS, PRIME_DTYPE, CatalogArrays, Topology, catalog_arrays, load_topology_catalog
 
 try:
     from pymatgen.core import Composition  # type: ignore
@@ -23,6 +23,9 @@ ELEMENT_SYMBOLS: Set[str] = {
     "H","He","Li","Be","B","C","N","O","F","Ne","Na","Mg","Al","Si","P","S","Cl","Ar","K","Ca","Sc","Ti","V","Cr","Mn","Fe","Co","Ni","Cu","Zn","Ga","Ge","As","Se","Br","Kr","Rb","Sr","Y","Zr","Nb","Mo","Tc","Ru","Rh","Pd","Ag","Cd","In","Sn","Sb","Te","I","Xe","Cs","Ba","La","Ce","Pr","Nd","Pm","Sm","Eu","Gd","Tb","Dy","Ho","Er","Tm","Yb","Lu","Hf","Ta","W","Re","Os","Ir","Pt","Au","Hg","Tl","Pb","Bi","Po","At","Rn","Fr","Ra","Ac","Th","Pa","U","Np","Pu","Am","Cm","Bk","Cf","Es","Fm","Md","No","Lr",
 }
 
+_ELEMENT_SYMBOLS_FROZEN = frozenset(ELEMENT_SYMBOLS)
+_FORMULA_RE = re.compile(r"[A-Z][a-z]?")
+
 
 @dataclass
 class AtomicHyperParams:
@@ -39,6 +42,7 @@ class AtomicHyperParams:
         return cls(lambda_xi=float(data.get("lambda_xi", data.get("lambda_noise", cls.lambda_xi))))
 
 
+@lru_cache(maxsize=4096)
 def _parse_formula(formula: str) -> Optional[str]:
     if not formula:
         return None
@@ -53,12 +57,15 @@ def _parse_formula(formula: str) -> Optional[str]:
             return None
         except Exception:
             return None
-    tokens = re.findall(r"[A-Z][a-z]?", formula)
-    unique = set(tokens)
-    if len(unique) == 1:
-        sym = list(unique)[0]
-        if sym in ELEMENT_SYMBOLS:
-            return sym
+    tokens = _FORMULA_RE.findall(formula)
+    if not tokens:
+        return None
+    sym = tokens[0]
+    # Single-element formulas repeat one symbol ("Fe", "O2", "FeFe"); any other token disqualifies.
+    if sym not in _ELEMENT_SYMBOLS_FROZEN:
+        return None
+    if len(tokens) == 1 or all(tok == sym for tok in tokens):
+        return sym
     return None
 
 
@@ -88,95 +95,102 @@ def is_elemental(row: pd.Series) -> Tuple[bool, Optional[str], str]:
 
 
 def compute_lock_mean(series: pd.Series) -> float:
-    vals = []
-    for v in series.dropna():
-        vals.append(math.exp(-abs(v - round(v))))
-    if not vals:
+    vals = series.dropna().to_numpy(dtype=np.float64)
+    if vals.size == 0:
         return float("nan")
-    return float(np.mean(vals))
+    # np.round rounds half to even, like the builtin round.
+    return float(np.exp(-np.abs(vals - np.round(vals))).mean())
+
+
+def _percentile_linear(values: np.ndarray, q: float) -> float:
+    """np.percentile(values, q) (linear method) from a two-point partial selection."""
+    pos = (q / 100.0) * (values.size - 1)
+    k = int(np.floor(pos))
+    if k + 1 >= values.size:
+        return float(np.partition(values, k)[k])
+    part = np.partition(values, [k, k + 1])
+    lo, hi, t = part[k], part[k + 1], pos - k
+    # Same interpolation as NumPy's _lerp, which anchors on the nearer neighbour.
+    return float(hi - (hi - lo) * (1.0 - t) if t >= 0.5 else lo + (hi - lo) * t)
 
 
 def infer_atomic_topologies(
     agg_df: pd.DataFrame,
     catalog: Sequence[Topology],
     params: AtomicHyperParams,
+    arrays: Optional[CatalogArrays] = None,
 ):
-    df = agg_df.copy()
+    """Score every element against every topology; pass `arrays` to reuse a stacked catalog."""
+    if arrays is None:
+        arrays = catalog_arrays(catalog)
+    # Read columns straight from the input; the only frame built from it is best_df below.
+    df = agg_df
+    n = len(df)
     xi_vals = df["xi_mean"].dropna()
-    xi_ref = np.percentile(xi_vals, 90) if not xi_vals.empty else 1.0
+    xi_ref = _percentile_linear(xi_vals.to_numpy(dtype=float), 90) if not xi_vals.empty else 1.0
     xi_ref = xi_ref if xi_ref > 0 else 1.0
 
-    score_records: List[dict] = []
-    best_records: List[dict] = []
-
-    for _, row in df.iterrows():
-        element = row.get("carrier_element")
-        e_vec = np.array([abs(row.get(f"{p}_mean", np.nan)) for p in PRIME_COLUMNS], dtype=float)
-        s = np.nansum(e_vec)
-        if not np.isfinite(s) or s <= 0:
-            e_norm = np.full(4, np.nan)
-        else:
-            e_norm = e_vec / s
-
-        xi_mean = row.get("xi_mean")
-        xi_norm = 0.0
-        if xi_mean is not None and not pd.isna(xi_mean):
-            xi_norm = float(min(1.0, max(0.0, xi_mean / xi_ref)))
-
-        N_mean = row.get("N_mean")
-        Q_lock = 0.0
-        if N_mean is not None and not pd.isna(N_mean):
-            Q_lock = float(math.exp(-abs(N_mean - round(N_mean))))
-
-        best_match = None
-        best_topo = None
-        best_ce = None
-        best_cxi = None
-        best_ctotal = None
-
-        for topo in catalog:
-            c_e = float(np.linalg.norm(e_norm - topo.w) ** 2) if np.isfinite(e_norm).all() else float("inf")
-            c_xi = xi_norm * topo.noise_sensitivity * (1.0 - Q_lock)
-            c_total = c_e + params.lambda_xi * c_xi
-            match = math.exp(-c_total)
-
-            score_records.append(
-                {
-                    "carrier_element": element,
-                    "block": row.get("block"),
-                    "topology_id": topo.topology_id,
-                    "C_e": c_e,
-                    "C_xi": c_xi,
-                    "C_total": c_total,
-                    "match_score": match,
-                    "xi_norm": xi_norm,
-                    "Q_lock": Q_lock,
-                    "n_materials_elemental": row.get("n_materials_elemental"),
-                }
-            )
-
-            if best_match is None or match > best_match:
-                best_match = match
-                best_topo = topo.topology_id
-                best_ce = c_e
-                best_cxi = c_xi
-                best_ctotal = c_total
-
-        best_records.append(
-            {
-                **{k: row.get(k) for k in row.index},
-                "Q_lock": Q_lock,
-                "xi_norm": xi_norm,
-                "best_topology": best_topo,
-                "best_match_score": best_match,
-                "C_total_min": best_ctotal,
-                "C_e_min": best_ce,
-                "C_xi_min": best_cxi,
-            }
-        )
-
-    scores_df = pd.DataFrame.from_records(score_records)
-    best_df = pd.DataFrame.from_records(best_records)
+    def _column(name: str) -> np.ndarray:
+        return df[name].to_numpy() if name in df else np.full(n, None, dtype=object)
+
+    # Element x prime magnitudes; a missing prime column behaves like an all-NaN one.
+    E = np.column_stack(
+        [
+            np.abs(df[f"{p}_mean"].to_numpy(dtype=PRIME_DTYPE)) if f"{p}_mean" in df else np.full(n, np.nan, dtype=PRIME_DTYPE)
+            for p in PRIME_COLUMNS
+        ]
+    )
+    s = np.nansum(E, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        E_norm = E / s[:, None]
+    E_norm[~np.isfinite(s) | (s <= 0)] = np.nan
+
+    xi_mean = df["xi_mean"].to_numpy(dtype=float)
+    xi_norm = np.where(np.isnan(xi_mean), 0.0, np.clip(xi_mean / xi_ref, 0.0, 1.0))
+    N_mean = df["N_mean"].to_numpy(dtype=float) if "N_mean" in df else np.full(n, np.nan)
+    Q_lock = np.where(np.isnan(N_mean), 0.0, np.exp(-np.abs(N_mean - np.round(N_mean))))
+
+    # Element x topology cost matrices in one broadcast each.
+    W = arrays.w.astype(PRIME_DTYPE)
+    noise_sensitivity = arrays.noise_sensitivity
+    topo_ids = arrays.ids
+    C_e = ((E_norm[:, None, :] - W[None, :, :]) ** 2).sum(axis=-1)
+    C_e[~np.isfinite(E_norm).all(axis=1)] = np.inf
+    C_xi = xi_norm[:, None] * noise_sensitivity[None, :] * (1.0 - Q_lock)[:, None]
+    C_total = C_e + params.lambda_xi * C_xi
+    match = np.exp(-C_total)
+
+    n_topo = len(topo_ids)
+    scores_df = pd.DataFrame(
+        {
+            "carrier_element": np.repeat(_column("carrier_element"), n_topo),
+            "block": np.repeat(_column("block"), n_topo),
+            "topology_id": np.tile(topo_ids, n),
+            "C_e": C_e.ravel(),
+            "C_xi": C_xi.ravel(),
+            "C_total": C_total.ravel(),
+            "match_score": match.ravel(),
+            "xi_norm": np.repeat(xi_norm, n_topo),
+            "Q_lock": np.repeat(Q_lock, n_topo),
+            "n_materials_elemental": np.repeat(_column("n_materials_elemental"), n_topo),
+        },
+        # Every column is a freshly built array; let the frame adopt them instead of copying.
+        copy=False,
+    )
+
+    best_cols = dict.fromkeys(["best_topology", "best_match_score", "C_total_min", "C_e_min", "C_xi_min"])
+    if n_topo:
+        # argmax keeps the first topology on ties, like the strict ">" scan it replaces.
+        best = match.argmax(axis=1)
+        rows = np.arange(n)
+        best_cols = {
+            "best_topology": topo_ids[best],
+            "best_match_score": match[rows, best],
+            "C_total_min": C_total[rows, best],
+            "C_e_min": C_e[rows, best],
+            "C_xi_min": C_xi[rows, best],
+        }
+    best_df = df.reset_index(drop=True).assign(Q_lock=Q_lock, xi_norm=xi_norm, **best_cols)
     return scores_df, best_df
 
 
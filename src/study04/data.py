@@ -2,10 +2,18 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow.parquet as pq  # type: ignore
+
+    HAS_PYARROW = True
+except Exception:
+    HAS_PYARROW = False
+
 PRIME_COLUMNS: List[str] = ["e2", "e3", "e5", "e7"]
 
 ALLOWED_CATEGORIES: Set[str] = {
@@ -25,95 +33,244 @@ class AggregationResult:
     warnings: List[str]
 
 
+def write_table(df: pd.DataFrame, csv_path: Path | str) -> None:
+    """Write a stage output as CSV, plus a typed Parquet sibling when pyarrow is available."""
+    csv_path = Path(csv_path)
+    df.to_csv(csv_path, index=False)
+    if HAS_PYARROW:
+        df.to_parquet(csv_path.with_suffix(".parquet"), index=False, compression="zstd")
+
+
+def read_table(csv_path: Path | str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Read a stage output, preferring an up-to-date Parquet sibling over re-parsing the CSV.
+
+    When `columns` is given only those columns are parsed; names absent from the
+    table are ignored so callers can list optional inputs.
+    """
+    csv_path = Path(csv_path)
+    wanted = None if columns is None else set(columns)
+    parquet_path = csv_path.with_suffix(".parquet")
+    if HAS_PYARROW and parquet_path.exists():
+        if not csv_path.exists() or parquet_path.stat().st_mtime >= csv_path.stat().st_mtime:
+            if wanted is None:
+                return pd.read_parquet(parquet_path)
+            present = [c for c in pq.read_schema(parquet_path).names if c in wanted]
+            return pd.read_parquet(parquet_path, columns=present)
+    if wanted is None:
+        return pd.read_csv(csv_path)
+    return pd.read_csv(csv_path, usecols=lambda c: c in wanted)
+
+
+# Low-cardinality label columns; categorical codes keep isin/groupby off per-cell string work.
+CATEGORICAL_COLUMNS: List[str] = ["carrier_element", "carrier_block", "category"]
+
+# Parse-time dtypes for the material CSV columns whose type is fixed by the curation: the labels
+# go straight to categoricals and the prime magnitudes stay float64, so the aggregated statistics
+# keep the decimals of the curated inputs. carrier_Z/group/period and include_study04 are left to
+# inference; the descriptors are coerced after load (a fractional or stray cell becomes NaN rather
+# than failing the parse) and the inclusion flag is recomputed by apply_inclusion_rules.
+MATERIAL_DTYPES: Dict[str, str] = {
+    **{col: "category" for col in CATEGORICAL_COLUMNS},
+    **{prime: "float64" for prime in PRIME_COLUMNS},
+}
+
+
 def load_material_data(path: Path | str) -> pd.DataFrame:
     """Load the curated material-level CSV."""
-    return pd.read_csv(Path(path))
+    return pd.read_csv(Path(path), dtype=MATERIAL_DTYPES)
+
+
+def _display_column(df: pd.DataFrame, col: str) -> pd.Series:
+    """Column rendered as the log messages print it ("None" when the column is absent)."""
+    if col not in df:
+        return pd.Series("None", index=df.index, dtype=object)
+    return df[col].astype(object).map(str)
+
+
+def _stripped_column(df: pd.DataFrame, col: str) -> pd.Series:
+    """Whitespace-stripped string values, keeping missing entries (and absent columns) as None."""
+    if col not in df:
+        return pd.Series(None, index=df.index, dtype=object)
+    values = df[col].astype(object)
+    return values.map(str, na_action="ignore").str.strip().where(values.notna(), None)
 
 
 def apply_inclusion_rules(df: pd.DataFrame, logger=None) -> pd.DataFrame:
     """Compute include_study04 deterministically and log decisions."""
-    df = df.copy()
     log_fn = logger.info if logger is not None else print
 
-    included_msgs: List[str] = []
-    excluded_msgs: List[str] = []
-
-    for idx, row in df.iterrows():
-        reasons: List[str] = []
-
-        carrier_element = None if pd.isna(row.get("carrier_element")) else str(row.get("carrier_element")).strip()
-        carrier_block = None if pd.isna(row.get("carrier_block")) else str(row.get("carrier_block")).strip()
-        category = row.get("category")
-
-        if not carrier_element:
-            reasons.append("missing_carrier_element")
-
-        if carrier_block not in {"s", "p", "d", "f"}:
-            reasons.append("invalid_carrier_block")
-
-        if category not in ALLOWED_CATEGORIES:
-            reasons.append(f"category_not_allowed:{category}")
-
-        primes = [row.get(p) for p in PRIME_COLUMNS]
-        all_nan = all(pd.isna(p) for p in primes)
-        all_zeroish = all((pd.isna(p) or p == 0) for p in primes)
-
-        if all_nan:
-            reasons.append("all_primes_nan")
-        elif all_zeroish:
-            reasons.append("all_primes_zero")
-
-        if reasons:
-            include = 0
-            reason_str = ",".join(reasons)
-            excluded_msgs.append(
-                f"[EXCLUDED][{reason_str}] name={row.get('name')} carrier={carrier_element} "
-                f"block={carrier_block} category={category}"
-            )
-        else:
-            include = 1
-            included_msgs.append(
-                f"[included] name={row.get('name')} carrier={carrier_element} block={carrier_block} category={category}"
-            )
-
-        df.at[idx, "include_study04"] = include
-
-    # Emit logs: included first, excluded last
-    for msg in included_msgs:
-        log_fn(msg)
-    for msg in excluded_msgs:
-        log_fn(msg)
-
-    included = int((df["include_study04"] == 1).sum())
-    excluded = int((df["include_study04"] == 0).sum())
+    carrier_element = _stripped_column(df, "carrier_element")
+    carrier_block = _stripped_column(df, "carrier_block")
+    category = df["category"] if "category" in df else pd.Series(None, index=df.index, dtype=object)
+    primes = df.reindex(columns=PRIME_COLUMNS)
+    prime_nan = primes.isna()
+    all_nan = prime_nan.all(axis=1)
+
+    rules = [
+        (carrier_element.isna() | (carrier_element == ""), "missing_carrier_element"),
+        (~carrier_block.isin(["s", "p", "d", "f"]), "invalid_carrier_block"),
+        (~category.isin(list(ALLOWED_CATEGORIES)), "category_not_allowed:" + _display_column(df, "category")),
+        (all_nan, "all_primes_nan"),
+        (~all_nan & (prime_nan | (primes == 0)).all(axis=1), "all_primes_zero"),
+    ]
+    reasons = pd.Series("", index=df.index, dtype=object)
+    for mask, reason in rules:
+        reasons = reasons.where(~mask, reasons + "," + reason)
+    reasons = reasons.str.lstrip(",")
+    excluded_mask = (reasons != "").to_numpy()
+    # assign() returns a new frame with the flag column, so the caller's frame is left untouched.
+    df = df.assign(include_study04=np.where(excluded_mask, 0, 1))
+
+    details = (
+        "name="
+        + _display_column(df, "name")
+        + " carrier="
+        + carrier_element.fillna("None")
+        + " block="
+        + carrier_block.fillna("None")
+        + " category="
+        + _display_column(df, "category")
+    )
+    # Emit logs: included first, excluded last, one call per bucket
+    included_msgs = ("[included] " + details[~excluded_mask]).tolist()
+    excluded_msgs = ("[EXCLUDED][" + reasons[excluded_mask] + "] " + details[excluded_mask]).tolist()
+    if included_msgs:
+        log_fn("\n".join(included_msgs))
+    if excluded_msgs:
+        log_fn("\n".join(excluded_msgs))
+
+    included = int((~excluded_mask).sum())
+    excluded = int(excluded_mask.sum())
     log_fn(f"[SUMMARY] included={included} excluded={excluded} total={len(df)}")
 
     return df
 
 
-def filter_included_rows(df: pd.DataFrame) -> pd.DataFrame:
-    """Keep rows flagged for Study 04 with valid carrier information."""
-    mask = (
+# Columns the element aggregation reads; it projects onto these instead of copying every column.
+AGG_INPUT_COLUMNS: List[str] = [
+    "carrier_element",
+    "carrier_block",
+    "carrier_Z",
+    "carrier_group",
+    "carrier_period",
+    *PRIME_COLUMNS,
+]
+
+
+def _included_mask(df: pd.DataFrame) -> pd.Series:
+    """Rows flagged for Study 04 that carry both a carrier element and a block."""
+    return (
         (df["include_study04"] == 1)
         & df["carrier_element"].notna()
         & df["carrier_block"].notna()
     )
-    return df.loc[mask].copy()
 
 
-def _coerce_optional_numeric(series: pd.Series) -> Optional[float]:
-    numeric = pd.to_numeric(series, errors="coerce")
-    if numeric.isna().all():
-        return None
-    return float(numeric.median())
+def filter_included_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep rows flagged for Study 04 with valid carrier information."""
+    # Boolean .loc already yields a new frame, so no extra copy is needed.
+    return df.loc[_included_mask(df)]
+
+
+def _aggregation_inputs(df: pd.DataFrame) -> pd.DataFrame:
+    """Included rows projected to the AGG_INPUT_COLUMNS present in `df`."""
+    return df.loc[_included_mask(df), [c for c in AGG_INPUT_COLUMNS if c in df.columns]]
+
+
+def _plain_labels(values):
+    """Hand out plain labels: category dtypes would carry every raw category into plots and one-hots."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.categories.dtype)
+    return values
+
+
+def _code_modes(codes: np.ndarray, n_groups: int, values: pd.Series) -> pd.api.extensions.ExtensionArray:
+    """
+    Most frequent non-null value per group code; ties go to the smallest value, like Series.mode.
 
+    The descriptors are small integers, so one bincount over (group, value) code
+    pairs gives every group's histogram and an argmax over each row picks the mode.
+    """
+    vcodes, uniques = pd.factorize(values, sort=True)
+    n_values = len(uniques)
+    if n_values == 0:
+        return values.array[:0].take(np.full(n_groups, -1), allow_fill=True)
+    valid = vcodes >= 0
+    counts = np.bincount(codes[valid] * n_values + vcodes[valid], minlength=n_groups * n_values)
+    counts = counts.reshape(n_groups, n_values)
+    best = np.where(counts.any(axis=1), counts.argmax(axis=1), -1)
+    return uniques.array.take(best, allow_fill=True)
+
+
+def group_modes(df: pd.DataFrame, key: str, col: str) -> pd.Series:
+    """Most frequent non-null `col` per `key` (sorted keys; NaN where a group has no value)."""
+    codes, uniques = pd.factorize(df[key], sort=True)
+    keep = codes >= 0
+    modes = _code_modes(codes[keep], len(uniques), df[col][keep])
+    return pd.Series(modes, index=pd.Index(uniques, name=key), name=col)
+
+
+def _abs_prime_stats(
+    codes: np.ndarray, values: np.ndarray, n_groups: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-group mean, median, sample std and non-null count of |values|, column by column.
+
+    `codes` are group codes in [0, n_groups); each output is (n_groups, n_columns).
+    Rows are stably sorted by group, so every (column, group) segment keeps its
+    row order, and segments of equal length are gathered into one (k, length)
+    block. Reducing a block along its rows runs the same pairwise float64 sum as
+    Series.mean/Series.std on each segment, so the statistics match the
+    per-group pandas results bit for bit; np.add.reduceat, bincount weights and
+    grouped (compensated) sums all round differently in the last bits, which is
+    enough to flip ties in the block rank tests.
+    """
+    n_cols = values.shape[1]
+    order = np.argsort(codes, kind="stable")
+    flat = np.abs(values[order]).T.ravel()
+    key = (np.arange(n_cols)[:, None] * n_groups + codes[order]).ravel()
+    valid = ~np.isnan(flat)
+    flat = flat[valid]
+    count = np.bincount(key[valid], minlength=n_cols * n_groups)
+    starts = np.cumsum(count) - count
+
+    mean = np.full(count.size, np.nan)
+    median = np.full(count.size, np.nan)
+    std = np.full(count.size, np.nan)
+    # One pass per distinct segment length, not per group.
+    for length in np.unique(count[count > 0]):
+        segments = np.flatnonzero(count == length)
+        block = flat[starts[segments, None] + np.arange(length)]
+        seg_mean = block.sum(axis=1) / length
+        mean[segments] = seg_mean
+        median[segments] = np.median(block, axis=1)
+        if length > 1:
+            std[segments] = np.sqrt(((seg_mean[:, None] - block) ** 2).sum(axis=1) / (length - 1))
+
+    def by_group(stat: np.ndarray) -> np.ndarray:
+        return stat.reshape(n_cols, n_groups).T
+
+    return by_group(mean), by_group(median), by_group(std), by_group(count)
+
+
+def abs_prime_stats(keys: pd.Series, values: np.ndarray, prefix: str = "") -> pd.DataFrame:
+    """
+    Per-group `{prefix}{prime}_{mean,median,std}` of |prime|, indexed by the sorted group keys.
 
-def _coerce_optional_mode(series: pd.Series) -> Optional[float]:
-    """Pick the most frequent non-null value if present."""
-    series = series.dropna()
-    if series.empty:
-        return None
-    return series.mode().iloc[0]
+    `values` is the (rows, primes) array in PRIME_COLUMNS order. Rows with a
+    missing key are dropped, as groupby does. The statistics come from
+    _abs_prime_stats, so they match per-group Series.mean/median/std exactly.
+    """
+    codes, uniques = pd.factorize(keys, sort=True)
+    keep = codes >= 0
+    mean, median, std, _ = _abs_prime_stats(codes[keep], values[keep], len(uniques))
+    stats = {}
+    for j, prime in enumerate(PRIME_COLUMNS):
+        stats[f"{prefix}{prime}_mean"] = mean[:, j]
+        stats[f"{prefix}{prime}_median"] = median[:, j]
+        stats[f"{prefix}{prime}_std"] = std[:, j]
+    return pd.DataFrame(stats, index=pd.Index(uniques, name=keys.name))
 
 
 def aggregate_element_table(df: pd.DataFrame) -> AggregationResult:
@@ -123,64 +280,73 @@ def aggregate_element_table(df: pd.DataFrame) -> AggregationResult:
     Returns:
         AggregationResult with an element-level table and any warnings emitted.
     """
-    filtered = filter_included_rows(df)
-    warnings: List[str] = []
-    records: List[dict] = []
+    filtered = _aggregation_inputs(df)
 
     if filtered.empty:
         raise ValueError("No rows satisfy include_study04 == 1 with valid carriers.")
+    for prime in PRIME_COLUMNS:
+        if prime not in filtered:
+            raise ValueError(f"Missing required prime column: {prime}")
+
+    # Sort rows by carrier once; every scalar per-carrier reduction below is then a
+    # reduceat over contiguous segments instead of a separate groupby.
+    keys = filtered["carrier_element"]
+    codes, uniques = pd.factorize(keys, sort=True)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(uniques)))
+    n_materials = np.diff(np.append(starts, len(codes)))
+
+    block_codes = pd.factorize(filtered["carrier_block"])[0][order]
+    not_unique = np.minimum.reduceat(block_codes, starts) != np.maximum.reduceat(block_codes, starts)
+    if not_unique.any():
+        element = uniques[np.argmax(not_unique)]
+        block_values = filtered.loc[keys == element, "carrier_block"].dropna().unique()
+        raise ValueError(
+            f"Carrier block not unique for element {element}: {block_values}"
+        )
+
+    # Collect finished per-carrier columns and build the table once at the end.
+    columns: Dict[str, object] = {
+        "element": _plain_labels(uniques),
+        "block": _plain_labels(filtered["carrier_block"].array[order[starts]]),
+        "n_materials": n_materials,
+    }
+
+    # Optional descriptors propagated for plotting/metadata.
+    if "carrier_Z" in filtered:
+        z = pd.to_numeric(filtered["carrier_Z"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        # NaNs sort to the end of each carrier's segment, so the median sits in the first `count` slots.
+        z_sorted = z[np.lexsort((z, codes))]
+        count = np.add.reduceat(~np.isnan(z_sorted), starts)
+        median = (z_sorted[starts + np.maximum(count - 1, 0) // 2] + z_sorted[starts + count // 2]) / 2.0
+        median[count == 0] = np.nan
+        columns["Z"] = median
+    if "carrier_group" in filtered:
+        columns["group"] = _code_modes(codes, len(uniques), filtered["carrier_group"])
+    if "carrier_period" in filtered:
+        columns["period"] = _code_modes(codes, len(uniques), filtered["carrier_period"])
+
+    mean, median, std, count = _abs_prime_stats(codes, filtered[PRIME_COLUMNS].to_numpy(dtype=float), len(uniques))
+    for j, prime in enumerate(PRIME_COLUMNS):
+        columns[f"{prime}_mean"] = mean[:, j]
+        columns[f"{prime}_median"] = median[:, j]
+        columns[f"{prime}_std"] = std[:, j]
+
+    warnings: List[str] = [
+        f"No valid values for {PRIME_COLUMNS[j]} in element {uniques[i]}; filling with NaN."
+        for i, j in zip(*np.nonzero(count == 0))
+    ]
 
-    for element, group in filtered.groupby("carrier_element"):
-        block_values = group["carrier_block"].dropna().unique()
-        if len(block_values) != 1:
-            raise ValueError(
-                f"Carrier block not unique for element {element}: {block_values}"
-            )
-        block = block_values[0]
-
-        record = {
-            "element": element,
-            "block": block,
-            "n_materials": int(len(group)),
-        }
-
-        # Optional descriptors propagated for plotting/metadata.
-        if "carrier_Z" in group:
-            z_val = _coerce_optional_numeric(group["carrier_Z"])
-            if z_val is not None:
-                record["Z"] = z_val
-        if "carrier_group" in group:
-            group_val = _coerce_optional_mode(group["carrier_group"])
-            if group_val is not None:
-                record["group"] = group_val
-        if "carrier_period" in group:
-            period_val = _coerce_optional_mode(group["carrier_period"])
-            if period_val is not None:
-                record["period"] = period_val
-
-        for prime in PRIME_COLUMNS:
-            if prime not in group:
-                raise ValueError(f"Missing required prime column: {prime}")
-            values = group[prime].abs().dropna()
-            if values.empty:
-                warnings.append(
-                    f"No valid values for {prime} in element {element}; filling with NaN."
-                )
-            record[f"{prime}_mean"] = values.mean()
-            record[f"{prime}_median"] = values.median()
-            record[f"{prime}_std"] = values.std(ddof=1)
-
-        records.append(record)
-
-    table = pd.DataFrame.from_records(records)
     prime_cols: List[str] = []
     for prime in PRIME_COLUMNS:
         prime_cols.extend(
             [f"{prime}_mean", f"{prime}_median", f"{prime}_std"]
         )
 
-    ordered_cols: List[str] = ["element", "block", "Z", "group", "period", "n_materials"]
-    ordered_cols += [c for c in prime_cols if c in table.columns]
-    table = table.reindex(columns=ordered_cols)
+    # Build straight into the final column order; absent optional descriptors become NaN columns.
+    ordered_cols: List[str] = ["element", "block", "Z", "group", "period", "n_materials", *prime_cols]
+    nan_column = np.full(len(uniques), np.nan)
+    table = pd.DataFrame({col: columns.get(col, nan_column) for col in ordered_cols})
 
     return AggregationResult(table=table, warnings=warnings)
@@ -1,49 +1,146 @@
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
 from .analysis import (
+    BLOCK_CODES,
     PRIMES,
+    as_block_codes,
+    block_mask,
     cliffs_delta,
     evaluate_classifier,
-    prepare_working_set,
+    prepare_working_arrays,
 )
 
 
-def _metric_snapshot(X: np.ndarray, labels: np.ndarray) -> Dict[str, Optional[float]]:
-    """Collect core scalar metrics used in null models."""
-    e2 = X[:, 0]
-    e5 = X[:, 2]
-    e7 = X[:, 3]
-    metrics = {
-        "delta_e2_p_vs_df": cliffs_delta(
-            e2[np.isin(labels, ["p"])], e2[np.isin(labels, ["d", "f"])]
-        ),
-        "delta_e5_df_vs_sp": cliffs_delta(
-            e5[np.isin(labels, ["d", "f"])], e5[np.isin(labels, ["s", "p"])]
-        ),
-        "delta_e7_df_vs_sp": cliffs_delta(
-            e7[np.isin(labels, ["d", "f"])], e7[np.isin(labels, ["s", "p"])]
-        ),
-    }
+# How the permutation null scores classifier accuracy: refit the cross-validated
+# classifier per shuffle, or use the closed-form in-sample LDA rule for both the
+# real labels and every shuffle.
+CLASSIFIER_NULL_METHODS = ("fit", "lda")
+
+# (metric key, prime column in X, group a labels, group b labels)
+DELTA_TESTS = (
+    ("delta_e2_p_vs_df", 0, ("p",), ("d", "f")),
+    ("delta_e5_df_vs_sp", 2, ("d", "f"), ("s", "p")),
+    ("delta_e7_df_vs_sp", 3, ("d", "f"), ("s", "p")),
+)
+
+
+def _batched_cliffs_delta(values: np.ndarray, masks_a: np.ndarray, masks_b: np.ndarray) -> np.ndarray:
+    """
+    Cliff's delta for every row of (n_batch, n) group masks.
+
+    `values` is either shared by the whole batch, shape (n,), or given per row,
+    shape (n_batch, n); masks broadcast against it. Each row is sorted once; a
+    running count of group-b members along that order gives, for every
+    element, how many b values lie strictly below and strictly above its tie
+    block, so each row's #(a > b) - #(a < b) is a single weighted sum.
+    """
+    values = np.atleast_2d(values)
+    batch = np.broadcast_shapes(values.shape, masks_a.shape, masks_b.shape)
+    order = np.argsort(values, axis=1, kind="stable")
+    v = np.take_along_axis(values, order, axis=1)
+    a = np.take_along_axis(np.broadcast_to(masks_a, batch), np.broadcast_to(order, batch), axis=1).astype(np.int64)
+    b = np.take_along_axis(np.broadcast_to(masks_b, batch), np.broadcast_to(order, batch), axis=1).astype(np.int64)
+    n_a = a.sum(axis=1)
+    n_b = b.sum(axis=1)
+    # b_before[:, k] = number of b members among the first k sorted values.
+    b_before = np.zeros((batch[0], batch[1] + 1), dtype=np.int64)
+    np.cumsum(b, axis=1, out=b_before[:, 1:])
+    # Tie-block bounds per sorted position: first index of the block, and one past its last.
+    n = v.shape[1]
+    idx = np.arange(n)
+    new_block = np.ones(v.shape, dtype=bool)
+    new_block[:, 1:] = v[:, 1:] != v[:, :-1]
+    first = np.maximum.accumulate(np.where(new_block, idx, 0), axis=1)
+    block_end = np.ones(v.shape, dtype=bool)
+    block_end[:, :-1] = new_block[:, 1:]
+    stop = np.minimum.accumulate(np.where(block_end, idx + 1, n)[:, ::-1], axis=1)[:, ::-1]
+    first = np.broadcast_to(first, batch)
+    stop = np.broadcast_to(stop, batch)
+    below = np.take_along_axis(b_before, first, axis=1)
+    above = n_b[:, None] - np.take_along_axis(b_before, stop, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = (a * (below - above)).sum(axis=1) / (n_a * n_b)
+    delta[(n_a == 0) | (n_b == 0)] = np.nan
+    return delta
+
+
+def _delta_masks(labels: np.ndarray) -> List[Tuple[str, int, np.ndarray, np.ndarray]]:
+    """Resolve DELTA_TESTS to (key, col, mask_a, mask_b) for fixed BLOCK_CODES labels."""
+    return [
+        (key, col, block_mask(labels, group_a), block_mask(labels, group_b))
+        for key, col, group_a, group_b in DELTA_TESTS
+    ]
+
+
+def _lda_accuracy(X: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    In-sample (s+p) vs (d+f) accuracy of a two-class LDA rule for each row of codes.
+
+    Class means come from one indicator matmul per batch and the pooled
+    within-class scatter from X^T X, so no estimator is fitted; points are
+    assigned by the midpoint of the projected class means. Rows with a single
+    class give NaN.
+    """
+    codes = np.atleast_2d(codes)
+    Y = codes >= BLOCK_CODES["d"]
+    n = X.shape[0]
+    n1 = Y.sum(axis=1).astype(float)
+    n0 = n - n1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        M1 = (Y @ X) / n1[:, None]
+        M0 = (X.sum(axis=0) - Y @ X) / n0[:, None]
+        scatter = (
+            (X.T @ X)[None, :, :]
+            - n1[:, None, None] * M1[:, :, None] * M1[:, None, :]
+            - n0[:, None, None] * M0[:, :, None] * M0[:, None, :]
+        )
+    defined = (n1 > 0) & (n0 > 0)
+    acc = np.full(len(Y), np.nan)
+    if defined.any():
+        w = (np.linalg.pinv(scatter[defined]) @ (M1 - M0)[defined][:, :, None])[:, :, 0]
+        threshold = ((M1[defined] + M0[defined]) * w).sum(axis=1) / 2.0
+        preds = (X @ w.T).T > threshold[:, None]
+        acc[defined] = (preds == Y[defined]).mean(axis=1)
+    return acc
+
+
+def _metric_snapshot(
+    X: np.ndarray,
+    labels: np.ndarray,
+    masks: Optional[List[Tuple[str, int, np.ndarray, np.ndarray]]] = None,
+) -> Dict[str, Optional[float]]:
+    """Collect core scalar metrics used in null models; labels are BLOCK_CODES ints.
+
+    Pass `masks` from _delta_masks when the labels stay fixed across calls.
+    """
+    if masks is None:
+        masks = _delta_masks(labels)
+    metrics = {key: cliffs_delta(X[mask_a, col], X[mask_b, col]) for key, col, mask_a, mask_b in masks}
     clf_res = evaluate_classifier(X, labels)
     metrics["classifier_accuracy"] = clf_res.accuracy
     return metrics
 
 
-def _empirical_p(real: float, null_samples: List[float]) -> Optional[float]:
-    arr = np.asarray([x for x in null_samples if x is not None and not np.isnan(x)])
-    if np.isnan(real) or real is None or arr.size == 0:
+def _finite_samples(null_samples: np.ndarray) -> np.ndarray:
+    arr = np.asarray(null_samples, dtype=float)
+    return arr[~np.isnan(arr)]
+
+
+def _empirical_p(real: float, null_samples: np.ndarray) -> Optional[float]:
+    arr = _finite_samples(null_samples)
+    if real is None or np.isnan(real) or arr.size == 0:
         return None
     extreme = np.sum(np.abs(arr) >= abs(real))
     return float((extreme + 1) / (arr.size + 1))
 
 
-def _z_score(real: float, null_samples: List[float]) -> Optional[float]:
-    arr = np.asarray([x for x in null_samples if x is not None and not np.isnan(x)])
-    if np.isnan(real) or real is None or arr.size < 2:
+def _z_score(real: float, null_samples: np.ndarray) -> Optional[float]:
+    arr = _finite_samples(null_samples)
+    if real is None or np.isnan(real) or arr.size < 2:
         return None
     return float((real - arr.mean()) / arr.std(ddof=1))
 
@@ -54,21 +151,54 @@ def run_permutation_nulls(
     prime_metric: str,
     n_perm: int = 5000,
     random_state: int = 0,
+    classifier_null: str = "fit",
 ):
     """Permute block labels to build null distributions."""
-    working, X, labels = prepare_working_set(agg_df, n_min=n_min, prime_metric=prime_metric)
+    X, labels_int = prepare_working_arrays(agg_df, n_min=n_min, prime_metric=prime_metric)
+    return run_permutation_nulls_from_arrays(
+        X, labels_int, n_perm=n_perm, random_state=random_state, classifier_null=classifier_null
+    )
+
+
+def run_permutation_nulls_from_arrays(
+    X: np.ndarray,
+    labels: np.ndarray,
+    n_perm: int = 5000,
+    random_state: int = 0,
+    classifier_null: str = "fit",
+):
+    """Permutation null on an already prepared working set (see prepare_working_arrays)."""
+    if classifier_null not in CLASSIFIER_NULL_METHODS:
+        raise ValueError(f"classifier_null must be one of {CLASSIFIER_NULL_METHODS}")
     if len(labels) == 0:
         return {"skipped_reason": "No elements pass n_min filter.", "n_perm": n_perm}
+    labels = as_block_codes(labels)
 
     rng = np.random.default_rng(random_state)
     real_metrics = _metric_snapshot(X, labels)
-    null_samples = {k: [] for k in real_metrics}
 
-    for _ in range(n_perm):
-        perm_labels = rng.permutation(labels)
-        metrics = _metric_snapshot(X, perm_labels)
-        for key, value in metrics.items():
-            null_samples[key].append(value)
+    # All shuffles in one draw: each row of the (n_perm, n) int8 matrix is an independent permutation.
+    perm_labels = rng.permuted(np.broadcast_to(labels, (n_perm, len(labels))), axis=1)
+    # Undefined accuracies (single-class shuffles) are stored as NaN and skipped by the summaries.
+    if classifier_null == "lda":
+        # Real and shuffled labels are scored by the same closed-form rule, in one batch.
+        real_acc = _lda_accuracy(X, labels)[0]
+        real_metrics["classifier_accuracy"] = None if np.isnan(real_acc) else float(real_acc)
+        accuracies = _lda_accuracy(X, perm_labels)
+    else:
+        accuracies = np.empty(n_perm, dtype=np.float64)
+        for i, row in enumerate(perm_labels):
+            acc = evaluate_classifier(X, row).accuracy
+            accuracies[i] = np.nan if acc is None else acc
+
+    # Effect sizes for all permutations at once; only the classifier needs the loop.
+    null_samples = {
+        key: _batched_cliffs_delta(
+            X[:, col], block_mask(perm_labels, group_a), block_mask(perm_labels, group_b)
+        )
+        for key, col, group_a, group_b in DELTA_TESTS
+    }
+    null_samples["classifier_accuracy"] = accuracies
 
     summary = {}
     for key, samples in null_samples.items():
@@ -80,16 +210,18 @@ def run_permutation_nulls(
             "real": None if real_metrics[key] is None or np.isnan(real_metrics[key]) else float(real_metrics[key]),
         }
     summary["n_perm"] = n_perm
+    summary["classifier_null"] = classifier_null
     summary["n_elements"] = len(labels)
     return summary
 
 
-def _random_rotation(dim: int, rng: np.random.Generator) -> np.ndarray:
-    """Generate a random orthogonal matrix using QR decomposition."""
-    A = rng.normal(size=(dim, dim))
+def _random_rotations(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Generate n random orthogonal matrices with one stacked QR decomposition."""
+    # One (n, dim, dim) draw consumes the generator exactly like n consecutive (dim, dim) draws.
+    A = rng.normal(size=(n, dim, dim))
     Q, R = np.linalg.qr(A)
-    signs = np.sign(np.diag(R))
-    Q *= signs
+    signs = np.sign(np.diagonal(R, axis1=1, axis2=2))
+    Q *= signs[:, None, :]
     return Q
 
 
@@ -104,20 +236,38 @@ def run_rotation_nulls(
     if n_rotations <= 0:
         return {"skipped_reason": "n_rotations set to 0."}
 
-    working, X, labels = prepare_working_set(agg_df, n_min=n_min, prime_metric=prime_metric)
+    X, labels_int = prepare_working_arrays(agg_df, n_min=n_min, prime_metric=prime_metric)
+    return run_rotation_nulls_from_arrays(X, labels_int, n_rotations=n_rotations, random_state=random_state)
+
+
+def run_rotation_nulls_from_arrays(
+    X: np.ndarray,
+    labels: np.ndarray,
+    n_rotations: int = 0,
+    random_state: int = 0,
+):
+    """Rotation null on an already prepared working set (see prepare_working_arrays)."""
+    if n_rotations <= 0:
+        return {"skipped_reason": "n_rotations set to 0."}
     if len(labels) == 0:
         return {"skipped_reason": "No elements pass n_min filter.", "n_rotations": n_rotations}
+    labels = as_block_codes(labels)
 
     rng = np.random.default_rng(random_state)
-    real_metrics = _metric_snapshot(X, labels)
-    rotation_samples = {k: [] for k in real_metrics}
-
-    for _ in range(n_rotations):
-        R = _random_rotation(dim=X.shape[1], rng=rng)
-        rotated = np.abs(X @ R)
-        metrics = _metric_snapshot(rotated, labels)
-        for key, value in metrics.items():
-            rotation_samples[key].append(value)
+    # Labels never change under rotation, so the group masks are resolved once.
+    masks = _delta_masks(labels)
+    real_metrics = _metric_snapshot(X, labels, masks)
+    rotation_samples = {k: np.empty(n_rotations, dtype=np.float64) for k in real_metrics}
+
+    rotations = _random_rotations(n_rotations, dim=X.shape[1], rng=rng)
+    # Broadcast matmul gives each slice exactly X @ R, so ties in |X R| resolve as before.
+    rotated_all = np.abs(X @ rotations)
+    # Effect sizes for every rotation at once (one sorted row per rotation); only the classifier loops.
+    for key, col, mask_a, mask_b in masks:
+        rotation_samples[key] = _batched_cliffs_delta(rotated_all[:, :, col], mask_a, mask_b)
+    for i, rotated in enumerate(rotated_all):
+        acc = evaluate_classifier(rotated, labels).accuracy
+        rotation_samples["classifier_accuracy"][i] = np.nan if acc is None else acc
 
     summary = {}
     for key, samples in rotation_samples.items():
@@ -3,7 +3,10 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Dict, Optional
 
+import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import Rectangle
 import pandas as pd
 import numpy as np
 import seaborn as sns
@@ -18,26 +21,32 @@ PRIME_PALETTE: Dict[str, str] = {
 }
 
 
-def _dominant_prime(row, prime_metric: str) -> str:
-    values = [row[f"{p}_{prime_metric}"] for p in PRIMES]
-    idx = int(np.argmax(values))
-    return PRIMES[idx]
+_THEME_APPLIED = False
 
 
-def _dominant_magnitude(row, prime_metric: str) -> float:
-    values = np.array([row[f"{p}_{prime_metric}"] for p in PRIMES], dtype=float)
-    return float(values.max())
+def _ensure_theme() -> None:
+    """Apply the seaborn whitegrid theme once per process instead of on every plot call."""
+    global _THEME_APPLIED
+    if not _THEME_APPLIED:
+        sns.set_theme(style="whitegrid")
+        _THEME_APPLIED = True
+
+
+def _dominant_primes(df: pd.DataFrame, prime_metric: str):
+    """Per-row dominant prime label and its magnitude (NaN rows behave like np.argmax/np.max)."""
+    M = df[[f"{p}_{prime_metric}" for p in PRIMES]].to_numpy(dtype=float)
+    idx = np.argmax(M, axis=1)
+    return np.asarray(PRIMES)[idx], M.max(axis=1)
 
 
 def plot_periodic_resonance_map(agg_df, output_path: Path, prime_metric: str = "mean"):
     """Draw a simple periodic map using group/period if available."""
     output_path = Path(output_path)
     fig, ax = plt.subplots(figsize=(12, 6))
-    sns.set(style="whitegrid")
+    _ensure_theme()
 
     df = agg_df.copy()
-    df["dominant_prime"] = df.apply(lambda r: _dominant_prime(r, prime_metric), axis=1)
-    df["dominant_mag"] = df.apply(lambda r: _dominant_magnitude(r, prime_metric), axis=1)
+    df["dominant_prime"], df["dominant_mag"] = _dominant_primes(df, prime_metric)
 
     # Positioning: prefer group/period; otherwise fall back to a simple grid.
     if {"group", "period"}.issubset(df.columns) and df[["group", "period"]].notna().all().all():
@@ -66,37 +75,20 @@ def plot_periodic_resonance_map(agg_df, output_path: Path, prime_metric: str = "
     min_mag = df["dominant_mag"].min()
     span = max(max_mag - min_mag, 1e-6)
 
-    for _, row in df.iterrows():
-        color = PRIME_PALETTE.get(row["dominant_prime"], "#888888")
-        intensity = 0.3 + 0.7 * ((row["dominant_mag"] - min_mag) / span)
-        rect = plt.Rectangle(
-            (row["x"] - 0.5, row["y_plot"] - 0.5),
-            1,
-            1,
-            facecolor=color,
-            alpha=float(intensity),
-            edgecolor="black",
-        )
-        ax.add_patch(rect)
-        ax.text(
-            row["x"],
-            row["y_plot"],
-            f"{row['element']}",
-            ha="center",
-            va="center",
-            fontsize=10,
-            fontweight="bold",
-            color="black",
-        )
-        ax.text(
-            row["x"],
-            row["y_plot"] - 0.25,
-            row["block"],
-            ha="center",
-            va="center",
-            fontsize=7,
-            color="black",
-        )
+    # One collection for all cells; per-cell alpha applies to face and edge, as Rectangle(alpha=...) does.
+    intensity = (0.3 + 0.7 * ((df["dominant_mag"] - min_mag) / span)).to_numpy(dtype=float)
+    facecolors = mcolors.to_rgba_array(df["dominant_prime"].map(PRIME_PALETTE).fillna("#888888").tolist())
+    facecolors[:, 3] = intensity
+    edgecolors = np.zeros((len(df), 4))
+    edgecolors[:, 3] = intensity
+    xs = df["x"].to_numpy(dtype=float)
+    ys = df["y_plot"].to_numpy(dtype=float)
+    cells = [Rectangle((x - 0.5, y - 0.5), 1, 1) for x, y in zip(xs, ys)]
+    # Rasterized so vector outputs (PDF/SVG) embed the grid as one image; labels stay vector text.
+    ax.add_collection(PatchCollection(cells, facecolors=facecolors, edgecolors=edgecolors, rasterized=True))
+    for x, y, element, block in zip(xs, ys, df["element"], df["block"]):
+        ax.text(x, y, f"{element}", ha="center", va="center", fontsize=10, fontweight="bold", color="black")
+        ax.text(x, y - 0.25, block, ha="center", va="center", fontsize=7, color="black")
 
     ax.set_xlim(df["x"].min() - 1, df["x"].max() + 1)
     ax.set_ylim(df["y_plot"].max() + 1, df["y_plot"].min() - 1)
@@ -2,17 +2,34 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
-from .data import PRIME_COLUMNS
+from .analysis import BLOCK_CODES, block_mask, encode_blocks
+from .data import PRIME_COLUMNS, write_table
 
 ABS_MIN_DEFAULT = 0.0
 ABS_MAX_DEFAULT = 5.0
 Z_THRESHOLD_DEFAULT = 2.5
 
+# Flag vocabularies, sorted so a row's flags join in name order; each is one column of the QC flag matrices.
+ERROR_FLAGS: Tuple[str, ...] = ("ERROR_all_primes_zero", "ERROR_missing_fingerprint", "ERROR_out_of_range")
+WARNING_FLAGS: Tuple[str, ...] = tuple(
+    sorted(
+        [
+            "WARN_ambiguous_dominant_prime",
+            *[f"WARN_outlier_global_{p}" for p in PRIME_COLUMNS],
+            *[f"WARN_outlier_vs_carrier_{p}" for p in PRIME_COLUMNS],
+            "WARN_outlier_vs_carrier_multi",
+            "WARN_too_pure_binary_for_d_or_f",
+            "WARN_unusual_for_p_block",
+        ]
+    )
+)
+_WARN_COL = {name: j for j, name in enumerate(WARNING_FLAGS)}
+
 
 @dataclass
 class QCSummary:
@@ -27,18 +44,51 @@ class QCSummary:
     warnings_by_type: Dict[str, int]
 
 
-def _flag(counter: Dict[str, int], key: str):
-    counter[key] = counter.get(key, 0) + 1
+def _join_flags(mask: np.ndarray, names: Sequence[str]) -> np.ndarray:
+    """";"-joined flag string per row of a (rows x flags) boolean matrix whose columns are `names`."""
+    flags = np.full(len(mask), "", dtype=object)
+    for j, name in enumerate(names):
+        hit = mask[:, j]
+        flags[hit] = np.where(flags[hit] == "", name, flags[hit] + ";" + name)
+    return flags
+
+
+def _count_flags(mask: np.ndarray, names: Sequence[str]) -> Dict[str, int]:
+    """Per-flag hit counts, keyed in the order a row-by-row scan would first meet them."""
+    counts = mask.sum(axis=0)
+    first_row = mask.argmax(axis=0)
+    order = sorted(np.flatnonzero(counts), key=lambda j: (first_row[j], j))
+    return {names[j]: int(counts[j]) for j in order}
 
 
-def _dominant_ratio(values: List[float]) -> float:
-    sorted_vals = sorted(values, reverse=True)
-    if len(sorted_vals) < 2:
-        return float("inf")
-    dom, second = sorted_vals[0], sorted_vals[1]
-    if second == 0:
-        return float("inf") if dom > 0 else 1.0
-    return dom / second
+def _group_moments(values: np.ndarray, codes: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-group column means and sample stds (ddof=1) as (n_groups, n_cols) arrays.
+
+    Rows with a negative code are ignored; groups with fewer than two rows get a NaN std.
+    """
+    keep = codes >= 0
+    codes, values = codes[keep], values[keep]
+    count = np.bincount(codes, minlength=n_groups)[:, None]
+    n_cols = values.shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.column_stack([np.bincount(codes, weights=values[:, j], minlength=n_groups) for j in range(n_cols)]) / count
+        dev = values - mean[codes]
+        var = np.column_stack([np.bincount(codes, weights=dev[:, j] ** 2, minlength=n_groups) for j in range(n_cols)]) / (count - 1)
+    var[count[:, 0] < 2] = np.nan
+    return mean, np.sqrt(var)
+
+
+def _dominant_ratio(values: np.ndarray) -> np.ndarray:
+    """Row-wise ratio of the largest to the second-largest value."""
+    if values.shape[1] < 2:
+        return np.full(len(values), np.inf)
+    # Only the top two matter: a partial partition selects them without sorting each row.
+    top2 = np.partition(values, -2, axis=1)[:, -2:]
+    dom, second = top2[:, 1], top2[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = dom / second
+    return np.where(second == 0, np.where(dom > 0, np.inf, 1.0), ratio)
 
 
 def run_fingerprint_qc(
@@ -60,149 +110,85 @@ def run_fingerprint_qc(
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    df = df.copy()
-    df["error_flags"] = ""
-    df["warning_flags"] = ""
+    # The caller's frame is only read; flags live in arrays until df_out is assembled.
+    n_rows = len(df)
+    included = (df["include_study04"] == 1).to_numpy()
+    n_included = int(included.sum())
 
-    included_mask = df["include_study04"] == 1
-    working = df.loc[included_mask].copy()
-
-    errors_by_type: Dict[str, int] = {}
-    warnings_by_type: Dict[str, int] = {}
+    # Every level works on one (rows x primes) array instead of walking rows.
+    prime = df[PRIME_COLUMNS].to_numpy(dtype=float)
+    abs_prime = np.abs(prime)
+    is_nan = np.isnan(prime)
 
     # Level 1: basic per-row checks
-    for idx, row in working.iterrows():
-        errors: List[str] = []
-        warnings: List[str] = []
-
-        prime_vals = [row.get(p) for p in PRIME_COLUMNS]
-        missing_primes = any(pd.isna(v) for v in prime_vals)
-        all_zero = all((pd.isna(v) or v == 0) for v in prime_vals)
-        has_any_value = (not missing_primes) and (not all_zero)
-
-        if not has_any_value:
-            errors.append("ERROR_missing_fingerprint")
-            if all_zero:
-                errors.append("ERROR_all_primes_zero")
-
-        # Range checks
-        for p, val in zip(PRIME_COLUMNS, prime_vals):
-            if pd.isna(val):
-                continue
-            if val == 0:
-                continue
-            if abs(val) < abs_min or abs(val) > abs_max:
-                errors.append("ERROR_out_of_range")
-                break
-
-        df.at[idx, "_missing_primes"] = missing_primes
-        df.at[idx, "_all_zero"] = all_zero
-        df.at[idx, "_has_any_value"] = has_any_value
-        working.at[idx, "_missing_primes"] = missing_primes
-        working.at[idx, "_all_zero"] = all_zero
-        working.at[idx, "_has_any_value"] = has_any_value
-
-        if errors:
-            df.at[idx, "error_flags"] = ";".join(sorted(set(errors)))
-            for e in set(errors):
-                _flag(errors_by_type, e)
-            log_fn(
-                f"[ERROR][{';'.join(sorted(set(errors)))}] "
-                f"name={row.get('name')} carrier={row.get('carrier_element')} "
-                f"category={row.get('category')}"
-            )
-            working.at[idx, "_errors_present"] = True
-        else:
-            working.at[idx, "_errors_present"] = False
+    missing_primes = is_nan.any(axis=1)
+    all_zero = (is_nan | (prime == 0)).all(axis=1)
+    has_any_value = ~missing_primes & ~all_zero
+    out_of_range = (((abs_prime < abs_min) | (abs_prime > abs_max)) & (prime != 0) & ~is_nan).any(axis=1)
+
+    error_mask = np.column_stack([all_zero, ~has_any_value, out_of_range]) & included[:, None]
+    error_flags = _join_flags(error_mask, ERROR_FLAGS)
+    errors_by_type = _count_flags(error_mask, ERROR_FLAGS)
+    errors_present = error_mask.any(axis=1)
+
+    names = df["name"].to_numpy()
+    carriers = df["carrier_element"].to_numpy()
+    categories = df["category"].to_numpy()
+    for i in np.flatnonzero(errors_present):
+        log_fn(
+            f"[ERROR][{error_flags[i]}] "
+            f"name={names[i]} carrier={carriers[i]} "
+            f"category={categories[i]}"
+        )
 
-        df.at[idx, "warning_flags"] = ""  # will append later
+    valid = included & ~errors_present & has_any_value
+    warn_mask = np.zeros((n_rows, len(WARNING_FLAGS)), dtype=bool)
 
     # Level 2: global percentile outliers
-    valid_working = working[(working["_errors_present"] == False) & (working["_has_any_value"] == True)]
-    abs_values = {p: valid_working[p].abs().dropna().to_numpy() for p in PRIME_COLUMNS}
-    percentiles = {}
-    for p, arr in abs_values.items():
-        if arr.size >= 1:
-            percentiles[p] = np.percentile(arr, [1, 99])
-        else:
-            percentiles[p] = (np.nan, np.nan)
-
-    for idx, row in valid_working.iterrows():
-        warnings: List[str] = []
-        for p in PRIME_COLUMNS:
-            val = abs(row.get(p)) if not pd.isna(row.get(p)) else np.nan
-            p1, p99 = percentiles[p]
-            if np.isnan(p1) or np.isnan(p99):
-                continue
-            if val < p1 or val > p99:
-                warnings.append(f"WARN_outlier_global_{p}")
-
-        # Level 3: per-carrier z-scores will be added later
-        df_warnings_existing = df.at[idx, "warning_flags"]
-        combined = set(df_warnings_existing.split(";") if df_warnings_existing else []) | set(warnings)
-        if combined:
-            df.at[idx, "warning_flags"] = ";".join(sorted([w for w in combined if w]))
-
-    # Level 3: consistency within carrier (z-score)
-    carrier_groups = valid_working.groupby("carrier_element")
-    carrier_stats = {}
-    for carrier, grp in carrier_groups:
-        if len(grp) < 2:
-            continue
-        carrier_stats[carrier] = {
-            p: (grp[p].abs().mean(), grp[p].abs().std(ddof=1)) for p in PRIME_COLUMNS
-        }
-
-    for idx, row in valid_working.iterrows():
-        carrier = row.get("carrier_element")
-        warnings: List[str] = []
-        if carrier in carrier_stats:
-            for p in PRIME_COLUMNS:
-                mean, std = carrier_stats[carrier][p]
-                val = abs(row.get(p))
-                if pd.isna(val) or std == 0 or pd.isna(std):
-                    continue
-                z = (val - mean) / std
-                if abs(z) > z_threshold:
-                    warnings.append(f"WARN_outlier_vs_carrier_{p}")
-            if sum(1 for w in warnings if "WARN_outlier_vs_carrier" in w) > 1:
-                warnings.append("WARN_outlier_vs_carrier_multi")
-
-        existing = df.at[idx, "warning_flags"]
-        combined = set(existing.split(";") if existing else []) | set(warnings)
-        if combined:
-            df.at[idx, "warning_flags"] = ";".join(sorted([w for w in combined if w]))
+    if valid.any():
+        p1, p99 = np.percentile(abs_prime[valid], [1, 99], axis=0)
+        global_cols = [_WARN_COL[f"WARN_outlier_global_{p}"] for p in PRIME_COLUMNS]
+        warn_mask[:, global_cols] = valid[:, None] & ((abs_prime < p1) | (abs_prime > p99))
+
+    # Level 3: consistency within carrier (z-score); single-material carriers have a NaN std and are skipped
+    carrier_codes, carrier_uniques = pd.factorize(df["carrier_element"])
+    carrier_codes = np.where(valid, carrier_codes, -1)
+    in_carrier = carrier_codes >= 0
+    mean_pc, std_pc = _group_moments(abs_prime, carrier_codes, len(carrier_uniques))
+    vs_carrier = np.zeros_like(is_nan)
+    row_codes = carrier_codes[in_carrier]
+    std = std_pc[row_codes]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (abs_prime[in_carrier] - mean_pc[row_codes]) / std
+    vs_carrier[in_carrier] = (np.abs(z) > z_threshold) & (std != 0)
+    warn_mask[:, [_WARN_COL[f"WARN_outlier_vs_carrier_{p}"] for p in PRIME_COLUMNS]] = vs_carrier
+    warn_mask[:, _WARN_COL["WARN_outlier_vs_carrier_multi"]] = vs_carrier.sum(axis=1) > 1
 
     # Level 4: soft heuristics
     # Dominant prime ambiguity
-    for idx, row in valid_working.iterrows():
-        vals = [abs(row.get(p)) if not pd.isna(row.get(p)) else 0.0 for p in PRIME_COLUMNS]
-        ratio = _dominant_ratio(vals)
-        warnings = []
-        if ratio < 1.1:
-            warnings.append("WARN_ambiguous_dominant_prime")
-
-        block = row.get("carrier_block")
-        # block heuristics require global stats
-        p_block = valid_working[valid_working["carrier_block"] == "p"]
-        df_block = valid_working[valid_working["carrier_block"].isin(["d", "f"])]
-        if block == "p" and not p_block.empty and not df_block.empty:
-            median_e2_p = p_block["e2"].abs().median()
-            median_e5_df = df_block["e5"].abs().median()
-            median_e7_df = df_block["e7"].abs().median()
-            if median_e2_p > 0 and median_e5_df >= 0 and median_e7_df >= 0:
-                if vals[0] < 0.5 * median_e2_p and (vals[2] > median_e5_df or vals[3] > median_e7_df):
-                    warnings.append("WARN_unusual_for_p_block")
-        if block in {"d", "f"}:
-            p10_e5 = valid_working["e5"].abs().quantile(0.10)
-            p10_e7 = valid_working["e7"].abs().quantile(0.10)
-            if vals[2] < p10_e5 and vals[3] < p10_e7:
-                warnings.append("WARN_too_pure_binary_for_d_or_f")
-
-        existing = df.at[idx, "warning_flags"]
-        combined = set(existing.split(";") if existing else []) | set(warnings)
-        if combined:
-            df.at[idx, "warning_flags"] = ";".join(sorted([w for w in combined if w]))
+    ratio = _dominant_ratio(np.where(is_nan, 0.0, abs_prime))
+    warn_mask[:, _WARN_COL["WARN_ambiguous_dominant_prime"]] = valid & (ratio < 1.1)
+
+    # Block heuristics compare each material against reference medians/deciles, hoisted out as
+    # (e5, e7) column pairs so each statistic is a single reduction.
+    abs_e2 = abs_prime[:, PRIME_COLUMNS.index("e2")]
+    abs_e57 = abs_prime[:, [PRIME_COLUMNS.index("e5"), PRIME_COLUMNS.index("e7")]]
+    block_codes = encode_blocks(df["carrier_block"])
+    p_block = valid & (block_codes == BLOCK_CODES["p"])
+    df_block = valid & block_mask(block_codes, ("d", "f"))
+    if p_block.any() and df_block.any():
+        median_e2_p = np.median(abs_e2[p_block])
+        median_e57_df = np.median(abs_e57[df_block], axis=0)
+        if median_e2_p > 0 and (median_e57_df >= 0).all():
+            warn_mask[:, _WARN_COL["WARN_unusual_for_p_block"]] = (
+                p_block & (abs_e2 < 0.5 * median_e2_p) & (abs_e57 > median_e57_df).any(axis=1)
+            )
+    if df_block.any():
+        p10_e57 = np.percentile(abs_e57[valid], 10, axis=0)
+        warn_mask[:, _WARN_COL["WARN_too_pure_binary_for_d_or_f"]] = df_block & (abs_e57 < p10_e57).all(axis=1)
+
+    warning_flags = _join_flags(warn_mask, WARNING_FLAGS)
+    warnings_by_type = _count_flags(warn_mask, WARNING_FLAGS)
 
     # Collect warning counts and log (only included materials)
     df_out = df[[
@@ -215,48 +201,24 @@ def run_fingerprint_qc(
         "e3",
         "e5",
         "e7",
-        "error_flags",
-        "warning_flags",
-    ]].copy()
-
-    for _, row in df_out.loc[df_out["include_study04"] == 1].iterrows():
-        warns = row.get("warning_flags") or ""
-        errs = row.get("error_flags") or ""
-        if warns:
-            for w in warns.split(";"):
-                if w:
-                    _flag(warnings_by_type, w)
-            log_fn(
-                f"[WARN][{warns}] name={row.get('name')} carrier={row.get('carrier_element')} category={row.get('category')}"
-            )
-        if errs:
-            # errors already logged during level 1
-            pass
+    ]].assign(error_flags=error_flags, warning_flags=warning_flags)
+
+    warned = included & warn_mask.any(axis=1)
+    for row in df_out.loc[warned].itertuples(index=False):
+        log_fn(
+            f"[WARN][{row.warning_flags}] name={row.name} carrier={row.carrier_element} category={row.category}"
+        )
 
     # Persist outputs
     per_material_path = output_dir / "fingerprint_qc_per_material.csv"
-    df_out = df[[
-        "name",
-        "category",
-        "carrier_element",
-        "carrier_block",
-        "include_study04",
-        "e2",
-        "e3",
-        "e5",
-        "e7",
-        "error_flags",
-        "warning_flags",
-    ]].copy()
-    df_out.to_csv(per_material_path, index=False)
+    write_table(df_out, per_material_path)
 
-    warn_count = int(((df_out["include_study04"] == 1) & (df_out["warning_flags"] != "")).sum())
     summary = QCSummary(
-        total_materials=int(len(df)),
-        checked_materials=int(len(working)),
-        included_count=int(len(working)),
-        excluded_count=int(len(df) - len(working)),
-        warned_included_count=warn_count,
+        total_materials=n_rows,
+        checked_materials=n_included,
+        included_count=n_included,
+        excluded_count=n_rows - n_included,
+        warned_included_count=int(warned.sum()),
         errors_total=sum(errors_by_type.values()),
         warnings_total=sum(warnings_by_type.values()),
         errors_by_type=errors_by_type,
@@ -282,11 +244,11 @@ def run_fingerprint_qc(
         f"warned_included={summary.warned_included_count} total={summary.total_materials}"
     )
 
-    # Stop pipeline if any included material has errors
-    errors_present = df_out.loc[(df_out["include_study04"] == 1) & (df_out["error_flags"] != "")]
-    if not errors_present.empty:
+    # Stop pipeline if any included material has errors (error flags are only raised on included rows)
+    n_blocking = int(errors_present.sum())
+    if n_blocking:
         raise SystemExit(
-            f"Fingerprint QC found blocking errors in {len(errors_present)} included materials. "
+            f"Fingerprint QC found blocking errors in {n_blocking} included materials. "
             "See data/processed/fingerprint_qc_per_material.csv"
         )
 
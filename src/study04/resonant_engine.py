@@ -8,7 +8,18 @@ from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
 import numpy as np
 import pandas as pd
 
-from .topology_engine import PRIME_COLUMNS, Topology, load_topology_catalog
+from .topology_engine import AGG_COLUMNS as _TOPOLOGY_AGG_COLUMNS
+from .topology_engine import PRIME_COLUMNS, PRIME_DTYPE, Topology, catalog_arrays, load_topology_catalog
+
+# Carrier aggregate columns read by infer_topologies (medians preferred, means as fallback).
+AGG_COLUMNS: List[str] = [
+    *_TOPOLOGY_AGG_COLUMNS,
+    "N_median",
+    *[f"abs_{p}_median" for p in PRIME_COLUMNS],
+]
+
+# Carriers per block in _fit_amplitude; bounds the (block, topologies, primes) residual temporaries.
+CARRIER_BLOCK = 4096
 
 # Complexity and N-scale heuristics per topology family
 COMPLEXITY: Dict[str, float] = {
@@ -63,43 +74,90 @@ class InferenceResult:
     summary: pd.DataFrame
 
 
-def _prime_vector(row: pd.Series) -> np.ndarray:
-    vec: List[float] = []
-    for p in PRIME_COLUMNS:
-        val = row.get(f"abs_{p}_median")
-        if pd.isna(val):
-            val = row.get(f"abs_{p}_mean")
-        vec.append(np.nan if pd.isna(val) else float(abs(val)))
-    return np.array(vec, dtype=float)
-
-
-def _fit_amplitude(e_obs: np.ndarray, w: np.ndarray, sigma_e: float) -> Tuple[float, float, np.ndarray]:
-    mask = ~np.isnan(e_obs)
-    if not mask.any():
-        return np.nan, float("inf"), np.full_like(e_obs, np.nan)
-    w_m = w[mask]
-    e_m = e_obs[mask]
-    denom = float(np.dot(w_m, w_m))
-    A = 0.0 if denom <= 0 else float(np.dot(e_m, w_m) / denom)
-    e_sim = A * w
-    ce = float(np.sum(((e_obs[mask] - e_sim[mask]) / sigma_e) ** 2))
-    return A, ce, e_sim
-
-
-def _q_lock(delta_N: Optional[float]) -> float:
-    if delta_N is None or pd.isna(delta_N):
-        return 0.0
-    return float(np.clip(1.0 - float(delta_N), 0.0, 1.0))
-
-
-def _xi_sim(q_lock: float, topo_id: str, params: HyperParams) -> float:
-    return float(params.xi_env + (1.0 - q_lock) * COMPLEXITY.get(topo_id, 1.0))
-
-
-def _n_sim(N_obs: Optional[float], topo_id: str) -> Optional[float]:
-    if N_obs is None or pd.isna(N_obs):
-        return None
-    return float(N_obs) * N_SCALE.get(topo_id, 1.0)
+def _prime_matrix(df: pd.DataFrame) -> np.ndarray:
+    """(carriers, primes) |e_p| observations: medians, falling back to means where the median is missing."""
+    cols = [f"abs_{p}_{stat}" for stat in ("median", "mean") for p in PRIME_COLUMNS]
+    values = df.reindex(columns=cols).to_numpy(dtype=PRIME_DTYPE)
+    med, mean = values[:, : len(PRIME_COLUMNS)], values[:, len(PRIME_COLUMNS) :]
+    return np.abs(np.where(np.isnan(med), mean, med))
+
+
+def _fit_amplitude_block(
+    e_obs: np.ndarray, W: np.ndarray, W_sq_T: np.ndarray, sigma_e: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    observed = ~np.isnan(e_obs)
+    E = np.where(observed, e_obs, 0.0)
+    num = E @ W.T
+    denom = observed.astype(E.dtype) @ W_sq_T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        A = np.where(denom > 0, num / denom, 0.0)
+    # One (block, T, P) buffer, updated in place, instead of a temporary per arithmetic step.
+    resid = A[:, :, None] * W[None, :, :]
+    np.subtract(E[:, None, :], resid, out=resid)
+    resid /= sigma_e
+    resid *= observed[:, None, :]
+    np.square(resid, out=resid)
+    C_e = resid.sum(axis=2)
+    empty = ~observed.any(axis=1)
+    A[empty] = np.nan
+    C_e[empty] = np.inf
+    return A, C_e
+
+
+def _fit_amplitude(e_obs: np.ndarray, W: np.ndarray, sigma_e: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Least-squares amplitude and C_e for every (carrier, topology) pair.
+
+    e_obs is (M, P) with NaN for unobserved primes, W is (T, P); both fits and
+    residuals use only each carrier's observed primes. Returns (A, C_e), each
+    (M, T); carriers without any observed prime get A=NaN and C_e=inf.
+    Carriers are independent, so they are processed in blocks of
+    CARRIER_BLOCK rows to keep the (block, T, P) residual tensor cache-sized.
+    """
+    W_sq_T = (W * W).T  # per-prime |w|^2 terms, masked per carrier by the matmul
+    A = np.empty((len(e_obs), len(W)), dtype=np.result_type(e_obs, W))
+    C_e = np.empty_like(A)
+    for start in range(0, len(e_obs), CARRIER_BLOCK):
+        rows = slice(start, start + CARRIER_BLOCK)
+        A[rows], C_e[rows] = _fit_amplitude_block(e_obs[rows], W, W_sq_T, sigma_e)
+    return A, C_e
+
+
+def topology_scales(catalog: Sequence[Topology]) -> Tuple[np.ndarray, np.ndarray]:
+    """COMPLEXITY and N_SCALE as (T,) arrays in catalog order; unknown families default to 1.0."""
+    complexity = np.array([COMPLEXITY.get(topo.topology_id, 1.0) for topo in catalog], dtype=float)
+    n_scale = np.array([N_SCALE.get(topo.topology_id, 1.0) for topo in catalog], dtype=float)
+    return complexity, n_scale
+
+
+def _squared_z(obs: np.ndarray, sim: np.ndarray, sigma: float) -> np.ndarray:
+    """((obs - sim) / sigma)**2 as (M, T), computed in place; carriers with NaN obs cost 0."""
+    out = np.subtract(obs[:, None], sim)
+    out /= sigma
+    np.square(out, out=out)
+    out[np.isnan(obs)] = 0.0
+    return out
+
+
+def _weighted_total(C_e: np.ndarray, C_N: np.ndarray, C_xi: np.ndarray, params: HyperParams) -> np.ndarray:
+    """C_e + lambda_N*C_N + lambda_xi*C_xi, left to right, with one output and one scratch buffer."""
+    total = np.multiply(C_N, params.lambda_N)
+    np.add(C_e, total, out=total)
+    scratch = np.multiply(C_xi, params.lambda_xi)
+    total += scratch
+    return total
+
+
+def _q_lock(delta_N: np.ndarray) -> np.ndarray:
+    return np.nan_to_num(np.clip(1.0 - delta_N, 0.0, 1.0), nan=0.0)
+
+
+def _xi_sim(q_lock: np.ndarray, complexity: np.ndarray, params: HyperParams) -> np.ndarray:
+    return params.xi_env + (1.0 - q_lock)[:, None] * complexity[None, :]
+
+
+def _n_sim(N_obs: np.ndarray, n_scale: np.ndarray) -> np.ndarray:
+    return N_obs[:, None] * n_scale[None, :]
 
 
 def infer_topologies(
@@ -115,105 +173,79 @@ def infer_topologies(
         raise ValueError("No carriers to process after filtering; check --elements")
 
     # Normalization helpers for plots
-    delta_vals = df["delta_N_median"].dropna()
     xi_vals = df["xi_ext_median"].dropna()
-    delta_min, delta_max = (delta_vals.min(), delta_vals.max()) if not delta_vals.empty else (0.0, 1.0)
     xi_min, xi_max = (xi_vals.min(), xi_vals.max()) if not xi_vals.empty else (0.0, 1.0)
-    delta_span = max(delta_max - delta_min, 1e-6)
     xi_span = max(xi_max - xi_min, 1e-6)
 
-    score_records: List[dict] = []
-    best_records: List[dict] = []
-
-    for _, row in df.iterrows():
-        element = row.get("carrier_element")
-        e_obs = _prime_vector(row)
-        N_obs = row.get("N_median")
-        delta_N = row.get("delta_N_median")
-        xi_obs = row.get("xi_ext_median")
-        q_lock = _q_lock(delta_N)
-        delta_norm = (float(delta_N) - delta_min) / delta_span if not pd.isna(delta_N) else 0.0
-        xi_norm = (float(xi_obs) - xi_min) / xi_span if not pd.isna(xi_obs) else 0.0
-        delta_norm = float(np.clip(delta_norm, 0.0, 1.0))
-        xi_norm = float(np.clip(xi_norm, 0.0, 1.0))
-
-        best_total = None
-        best_topo = None
-        best_ce = None
-        best_cn = None
-        best_cxi = None
-        best_amp = None
-
-        element_totals: List[float] = []
-
-        for topo in catalog:
-            A_T, C_e, e_sim = _fit_amplitude(e_obs, topo.w, params.sigma_e)
-            N_sim = _n_sim(N_obs, topo.topology_id)
-            C_N = 0.0
-            if N_obs is not None and not pd.isna(N_obs) and N_sim is not None:
-                C_N = float(((N_obs - N_sim) / params.sigma_N) ** 2)
-            xi_sim = _xi_sim(q_lock, topo.topology_id, params)
-            C_xi = 0.0
-            if xi_obs is not None and not pd.isna(xi_obs):
-                C_xi = float(((xi_obs - xi_sim) / params.sigma_xi) ** 2)
-
-            C_total = C_e + params.lambda_N * C_N + params.lambda_xi * C_xi
-            element_totals.append(C_total)
-
-            score_records.append(
-                {
-                    "carrier_element": element,
-                    "block": row.get("block"),
-                    "topology_id": topo.topology_id,
-                    "C_e": C_e,
-                    "C_N": C_N,
-                    "C_xi": C_xi,
-                    "C_total": C_total,
-                    "A_T": A_T,
-                    "N_obs": N_obs,
-                    "N_sim": N_sim,
-                    "xi_obs": xi_obs,
-                    "xi_sim": xi_sim,
-                    "q_lock": q_lock,
-                }
-            )
-
-            if best_total is None or C_total < best_total:
-                best_total = C_total
-                best_topo = topo.topology_id
-                best_ce = C_e
-                best_cn = C_N
-                best_cxi = C_xi
-                best_amp = A_T
-
-        max_total = max(element_totals) if element_totals else float("inf")
-        confidence = 0.0 if not element_totals or max_total == 0 else 1.0 - (best_total / max_total)
-
-        best_records.append(
-            {
-                "carrier_element": element,
-                "block": row.get("block"),
-                "carrier_group": row.get("carrier_group"),
-                "carrier_period": row.get("carrier_period"),
-                "carrier_Z": row.get("carrier_Z"),
-                "n_materials": row.get("n_materials"),
-                "N_obs": N_obs,
-                "delta_N_median": delta_N,
-                "xi_obs": xi_obs,
-                "xi_norm": xi_norm,
-                "Q_lock": q_lock,
-                "best_topology": best_topo,
-                "C_total_min": best_total,
-                "C_e_min": best_ce,
-                "C_N_min": best_cn,
-                "C_xi_min": best_cxi,
-                "A_best": best_amp,
-                "confidence": confidence,
-            }
-        )
-
-    scores_df = pd.DataFrame.from_records(score_records)
-    best_df = pd.DataFrame.from_records(best_records)
+    # All (carrier, topology) costs are (M, T) arrays; carriers are rows, catalog entries columns.
+    e_obs = _prime_matrix(df)
+    N_obs = df["N_median"].to_numpy(dtype=float)
+    delta_N = df["delta_N_median"].to_numpy(dtype=float)
+    xi_obs = df["xi_ext_median"].to_numpy(dtype=float)
+    q_lock = _q_lock(delta_N)
+    xi_norm = np.nan_to_num(np.clip((xi_obs - xi_min) / xi_span, 0.0, 1.0), nan=0.0)
+
+    arrays = catalog_arrays(catalog)
+    W, topo_ids = arrays.w.astype(PRIME_DTYPE), arrays.ids
+    complexity, n_scale = topology_scales(catalog)
+    n_carriers, n_topos = len(df), len(topo_ids)
+
+    A_T, C_e = _fit_amplitude(e_obs, W, params.sigma_e)
+    N_sim = _n_sim(N_obs, n_scale)
+    C_N = _squared_z(N_obs, N_sim, params.sigma_N)
+    xi_sim = _xi_sim(q_lock, complexity, params)
+    C_xi = _squared_z(xi_obs, xi_sim, params.sigma_xi)
+    C_total = _weighted_total(C_e, C_N, C_xi, params)
+
+    # argmin keeps the first topology on ties, like the strict "<" scan it replaces.
+    best = np.argmin(C_total, axis=1)
+    rows = np.arange(n_carriers)
+    best_total = C_total[rows, best]
+    max_total = C_total.max(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        confidence = np.where(max_total == 0, 0.0, 1.0 - best_total / max_total)
+
+    elements_arr = df["carrier_element"].to_numpy()
+    blocks = df["block"].to_numpy()
+    scores_df = pd.DataFrame(
+        {
+            "carrier_element": np.repeat(elements_arr, n_topos),
+            "block": np.repeat(blocks, n_topos),
+            "topology_id": np.tile(topo_ids, n_carriers),
+            "C_e": C_e.ravel(),
+            "C_N": C_N.ravel(),
+            "C_xi": C_xi.ravel(),
+            "C_total": C_total.ravel(),
+            "A_T": A_T.ravel(),
+            "N_obs": np.repeat(N_obs, n_topos),
+            "N_sim": N_sim.ravel(),
+            "xi_obs": np.repeat(xi_obs, n_topos),
+            "xi_sim": xi_sim.ravel(),
+            "q_lock": np.repeat(q_lock, n_topos),
+        }
+    )
+    best_df = pd.DataFrame(
+        {
+            "carrier_element": elements_arr,
+            "block": blocks,
+            "carrier_group": df["carrier_group"].to_numpy(),
+            "carrier_period": df["carrier_period"].to_numpy(),
+            "carrier_Z": df["carrier_Z"].to_numpy(),
+            "n_materials": df["n_materials"].to_numpy(),
+            "N_obs": N_obs,
+            "delta_N_median": delta_N,
+            "xi_obs": xi_obs,
+            "xi_norm": xi_norm,
+            "Q_lock": q_lock,
+            "best_topology": topo_ids[best],
+            "C_total_min": best_total,
+            "C_e_min": C_e[rows, best],
+            "C_N_min": C_N[rows, best],
+            "C_xi_min": C_xi[rows, best],
+            "A_best": A_T[rows, best],
+            "confidence": confidence,
+        }
+    )
     return InferenceResult(scores=scores_df, summary=best_df)
 
 
@@ -224,4 +256,5 @@ __all__ = [
     "InferenceResult",
     "infer_topologies",
     "load_topology_catalog",
+    "topology_scales",
 ]
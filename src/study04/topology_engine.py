@@ -3,13 +3,31 @@ from __future__ import annotations
 import json
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
 PRIME_COLUMNS = ["e2", "e3", "e5", "e7"]
 
+# dtype of the prime magnitude and topology weight matrices in every engine. The cost and amplitude
+# columns are computed from them and published, so they stay float64: float32 moved C_e by up to 2e-4
+# and left C_e/A_T single precision next to float64 C_total in the same score table.
+PRIME_DTYPE = np.float64
+
+# Carrier aggregate columns read by aggregate_costs (see read_table's `columns`).
+AGG_COLUMNS = [
+    "carrier_element",
+    "block",
+    "carrier_group",
+    "carrier_period",
+    "carrier_Z",
+    "n_materials",
+    "delta_N_median",
+    "xi_ext_median",
+    *[f"abs_{p}_mean" for p in PRIME_COLUMNS],
+]
+
 
 @dataclass
 class Topology:
@@ -44,6 +62,24 @@ def load_topology_catalog(path: Path | str) -> List[Topology]:
     return catalog
 
 
+@dataclass(frozen=True)
+class CatalogArrays:
+    """Column-wise view of a topology catalog, in catalog order."""
+
+    ids: np.ndarray  # (T,) topology ids
+    w: np.ndarray  # (T, 4) normalized prime weights
+    noise_sensitivity: np.ndarray  # (T,)
+
+
+def catalog_arrays(catalog: Sequence[Topology]) -> CatalogArrays:
+    """Stack a catalog's weights, noise sensitivities and ids once for vectorized scoring."""
+    return CatalogArrays(
+        ids=np.array([topo.topology_id for topo in catalog], dtype=object),
+        w=np.array([topo.w for topo in catalog], dtype=float).reshape(len(catalog), len(PRIME_COLUMNS)),
+        noise_sensitivity=np.array([topo.noise_sensitivity for topo in catalog], dtype=float),
+    )
+
+
 def normalize_primes(row: pd.Series, metric_prefix: str = "abs") -> np.ndarray:
     vec = np.array([row[f"{metric_prefix}_{p}_mean"] for p in PRIME_COLUMNS], dtype=float)
     vec = np.abs(vec)
@@ -53,6 +89,14 @@ def normalize_primes(row: pd.Series, metric_prefix: str = "abs") -> np.ndarray:
     return vec / s
 
 
+def _normalized_prime_matrix(df: pd.DataFrame, metric_prefix: str = "abs") -> np.ndarray:
+    """Row-wise normalize_primes over a whole carrier table."""
+    mat = np.abs(df[[f"{metric_prefix}_{p}_mean" for p in PRIME_COLUMNS]].to_numpy(dtype=PRIME_DTYPE))
+    s = mat.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(s <= 0, 0.25, mat / s)
+
+
 def compute_ce(vec: np.ndarray, topo: Topology) -> float:
     return float(np.linalg.norm(vec - topo.w) ** 2)
 
@@ -64,9 +108,6 @@ def aggregate_costs(
     use_noise: bool = True,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """Compute C_e, C_xi, C_total for each carrier/topology."""
-    records = []
-    per_carrier_best = []
-
     delta_vals = carrier_df["delta_N_median"].dropna()
     xi_vals = carrier_df["xi_ext_median"].dropna()
     delta_min, delta_max = delta_vals.min(), delta_vals.max()
@@ -74,69 +115,61 @@ def aggregate_costs(
     delta_span = max(delta_max - delta_min, 1e-6)
     xi_span = max(xi_max - xi_min, 1e-6)
 
-    for _, row in carrier_df.iterrows():
-        e_norm = normalize_primes(row, metric_prefix="abs")
-        delta_N = row.get("delta_N_median")
-        xi_ext = row.get("xi_ext_median")
-        if pd.isna(delta_N):
-            Q_lock = 0.0
-        else:
-            Q_lock = 1.0 - (delta_N - delta_min) / delta_span
-            Q_lock = float(np.clip(Q_lock, 0.0, 1.0))
-        if pd.isna(xi_ext):
-            xi_norm = 0.0
-        else:
-            xi_norm = (xi_ext - xi_min) / xi_span
-            xi_norm = float(np.clip(xi_norm, 0.0, 1.0))
-
-        best_ce = None
-        best_total = None
-        best_topo_e = None
-        best_topo_total = None
-
-        for topo in catalog:
-            c_e = compute_ce(e_norm, topo)
-            c_xi = xi_norm * topo.noise_sensitivity * (1.0 - Q_lock) if use_noise else 0.0
-            c_total = c_e + lambda_noise * c_xi if use_noise else c_e
-
-            records.append(
-                {
-                    "carrier_element": row.get("carrier_element"),
-                    "block": row.get("block"),
-                    "n_materials": row.get("n_materials"),
-                    "topology_id": topo.topology_id,
-                    "C_e": c_e,
-                    "C_xi": c_xi,
-                    "C_total": c_total,
-                    "Q_lock": Q_lock,
-                    "xi_norm": xi_norm,
-                }
-            )
-
-            if best_ce is None or c_e < best_ce:
-                best_ce = c_e
-                best_topo_e = topo.topology_id
-            if best_total is None or c_total < best_total:
-                best_total = c_total
-                best_topo_total = topo.topology_id
-
-        per_carrier_best.append(
-            {
-                "carrier_element": row.get("carrier_element"),
-                "block": row.get("block"),
-                "group": row.get("carrier_group"),
-                "period": row.get("carrier_period"),
-                "Z": row.get("carrier_Z"),
-                "n_materials": row.get("n_materials"),
-                "Q_lock": Q_lock,
-                "xi_norm": xi_norm,
-                "best_topology_e_only": best_topo_e,
-                "C_e_min": best_ce,
-                "best_topology": best_topo_total,
-                "C_total_min": best_total,
-            }
-        )
-
-    scores_df = pd.DataFrame.from_records(records)
-    best_df = pd.DataFrame.from_records(per_carrier_best)
+    e_norm_mat = _normalized_prime_matrix(carrier_df, metric_prefix="abs")
+    delta_arr = carrier_df["delta_N_median"].to_numpy(dtype=float)
+    xi_arr = carrier_df["xi_ext_median"].to_numpy(dtype=float)
+    Q_lock = np.nan_to_num(np.clip(1.0 - (delta_arr - delta_min) / delta_span, 0.0, 1.0), nan=0.0)
+    xi_norm = np.nan_to_num(np.clip((xi_arr - xi_min) / xi_span, 0.0, 1.0), nan=0.0)
+
+    # (carriers, topologies) cost matrices; rows follow carrier_df, columns the catalog.
+    arrays = catalog_arrays(catalog)
+    W, topo_ids, noise_sensitivity = arrays.w.astype(PRIME_DTYPE), arrays.ids, arrays.noise_sensitivity
+    n_carriers, n_topos = len(carrier_df), len(topo_ids)
+
+    C_e = np.linalg.norm(e_norm_mat[:, None, :] - W[None, :, :], axis=2) ** 2
+    if use_noise:
+        C_xi = xi_norm[:, None] * noise_sensitivity[None, :]
+        C_xi *= (1.0 - Q_lock)[:, None]
+        C_total = np.multiply(C_xi, lambda_noise)
+        np.add(C_e, C_total, out=C_total)
+    else:
+        C_xi = np.zeros_like(C_e)
+        C_total = C_e
+    # argmin keeps the first topology on ties, like the strict "<" scan it replaces.
+    best_e = np.argmin(C_e, axis=1)
+    best_total = np.argmin(C_total, axis=1)
+    rows = np.arange(n_carriers)
+
+    elements = carrier_df["carrier_element"].to_numpy()
+    blocks = carrier_df["block"].to_numpy()
+    n_materials = carrier_df["n_materials"].to_numpy()
+    scores_df = pd.DataFrame(
+        {
+            "carrier_element": np.repeat(elements, n_topos),
+            "block": np.repeat(blocks, n_topos),
+            "n_materials": np.repeat(n_materials, n_topos),
+            "topology_id": np.tile(topo_ids, n_carriers),
+            "C_e": C_e.ravel(),
+            "C_xi": C_xi.ravel(),
+            "C_total": C_total.ravel(),
+            "Q_lock": np.repeat(Q_lock, n_topos),
+            "xi_norm": np.repeat(xi_norm, n_topos),
+        }
+    )
+    best_df = pd.DataFrame(
+        {
+            "carrier_element": elements,
+            "block": blocks,
+            "group": carrier_df["carrier_group"].to_numpy(),
+            "period": carrier_df["carrier_period"].to_numpy(),
+            "Z": carrier_df["carrier_Z"].to_numpy(),
+            "n_materials": n_materials,
+            "Q_lock": Q_lock,
+            "xi_norm": xi_norm,
+            "best_topology_e_only": topo_ids[best_e],
+            "C_e_min": C_e[rows, best_e],
+            "best_topology": topo_ids[best_total],
+            "C_total_min": C_total[rows, best_total],
+        }
+    )
     return scores_df, best_df
@@ -4,10 +4,13 @@ from pathlib import Path
 from typing import Dict
 
 import matplotlib.pyplot as plt
+from matplotlib.collections import PatchCollection
 import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from .plots import _ensure_theme
+
 TOPO_PALETTE: Dict[str, str] = {
     "BIN_DIPOLE": "#1f77b4",
     "TRI_RING": "#2ca02c",
@@ -29,28 +32,28 @@ def _layout_positions(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def plot_topology_map(assign_df: pd.DataFrame, value_col: str, output_path: Path, title: str):
+    """Draw one cell per carrier colored by `value_col`."""
     output_path = Path(output_path)
-    sns.set(style="whitegrid")
+    _ensure_theme()
     fig, ax = plt.subplots(figsize=(12, 6))
 
-    df = _layout_positions(assign_df.copy())
+    df = _layout_positions(assign_df)
     unique_topos = df[value_col].unique()
     palette = {k: TOPO_PALETTE.get(k, "#888888") for k in unique_topos}
 
-    for _, row in df.iterrows():
-        topo = row[value_col]
-        color = palette.get(topo, "#888888")
-        rect = plt.Rectangle(
-            (row["x"] - 0.5, row["y_plot"] - 0.5),
-            1,
-            1,
-            facecolor=color,
-            alpha=0.9,
-            edgecolor="black",
-        )
-        ax.add_patch(rect)
-        ax.text(row["x"], row["y_plot"], row["carrier_element"], ha="center", va="center", fontsize=9, fontweight="bold")
-        ax.text(row["x"], row["y_plot"] - 0.25, str(row.get("block", "")), ha="center", va="center", fontsize=7)
+    # One collection for all cells instead of one Rectangle artist per carrier.
+    xs = df["x"].to_numpy(dtype=float)
+    ys = df["y_plot"].to_numpy(dtype=float)
+    colors = [palette.get(topo, "#888888") for topo in df[value_col]]
+    cells = [plt.Rectangle((x - 0.5, y - 0.5), 1, 1) for x, y in zip(xs, ys)]
+    ax.add_collection(PatchCollection(cells, facecolors=colors, edgecolors="black", alpha=0.9))
+    blocks = df["block"].map(str) if "block" in df else [""] * len(df)
+    for x, y, element in zip(xs, ys, df["carrier_element"]):
+        ax.text(x, y, element, ha="center", va="center", fontsize=9, fontweight="bold")
+    for x, y, block in zip(xs, ys, blocks):
+        if not block:
+            continue
+        ax.text(x, y - 0.25, block, ha="center", va="center", fontsize=7)
 
     ax.set_xlim(df["x"].min() - 1, df["x"].max() + 1)
     ax.set_ylim(df["y_plot"].max() + 1, df["y_plot"].min() - 1)
@@ -83,18 +86,15 @@ def plot_lock_noise_scatter(assign_df: pd.DataFrame, output_path: Path):
 
 def plot_match_matrix(scores_df: pd.DataFrame, output_path: Path):
     output_path = Path(output_path)
-    pivot_entries = []
-    for elem, grp in scores_df.groupby("carrier_element"):
-        c_min = grp["C_total"].min()
-        c_max = grp["C_total"].max()
-        span = max(c_max - c_min, 1e-6)
-        for _, row in grp.iterrows():
-            match = 1.0 - ((row["C_total"] - c_min) / span)
-            pivot_entries.append({"carrier_element": elem, "topology_id": row["topology_id"], "match_score": match})
-    pivot_df = pd.DataFrame(pivot_entries)
-    if pivot_df.empty:
+    # Min-max normalize C_total within each carrier: 1 = best topology, 0 = worst.
+    df = scores_df.dropna(subset=["carrier_element"])
+    if df.empty:
         return
-    matrix = pivot_df.pivot(index="carrier_element", columns="topology_id", values="match_score")
+    c_total = df.groupby("carrier_element")["C_total"]
+    c_min = c_total.transform("min")
+    span = np.maximum(c_total.transform("max") - c_min, 1e-6)
+    match = 1.0 - (df["C_total"] - c_min) / span
+    matrix = df.assign(match_score=match).pivot(index="carrier_element", columns="topology_id", values="match_score")
     fig, ax = plt.subplots(figsize=(10, max(4, 0.25 * len(matrix))))
     sns.heatmap(matrix, ax=ax, cmap="Blues", vmin=0, vmax=1, cbar_kws={"label": "Match score"})
     ax.set_xlabel("Topology")